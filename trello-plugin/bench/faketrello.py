@@ -0,0 +1,247 @@
+'''
+Local stand-in for the Trello REST API used by the benchmarks.
+
+Serves one generated board with a list of N cards, each with comments,
+checklists, attachments, labels and members, and counts the calls it
+receives per endpoint.
+'''
+import json
+import random
+import re
+import threading
+import time
+import urlparse
+import BaseHTTPServer
+import SocketServer
+
+WORDS = ['card', 'ticket', 'deploy', 'snake_case_name', 'fix', 'release', 'trac',
+         'trello', 'board', 'review', 'merge', '**bold**', '_em_', '`code`']
+
+
+class FakeData(object):
+    def __init__(self, cards=50, comments=10, checklists=2, items=5, attachments=2, members=8, seed=42):
+        self.rnd = random.Random(seed)
+        self.counter = 0
+        self.start = int(time.time()) - 86400 * 30
+        self.members = [{'id' : self.newId(), 'username' : 'user%d' % i, 'fullName' : 'User %d' % i} for i in range(members)]
+        self.labels = [{'id' : self.newId(), 'color' : c, 'name' : n} for c, n in [('green', 'ok'), ('red', 'bug'), ('blue', '')]]
+        self.board = {'id' : self.newId(), 'name' : 'Bench board'}
+        self.list = {'id' : self.newId(), 'name' : 'Bench list', 'idBoard' : self.board['id']}
+        self.cards = []
+        self.actions = []
+        for n in range(cards):
+            self.cards.append(self.newCard(n + 1, comments, checklists, items, attachments))
+        self.cardsById = dict((c['id'], c) for c in self.cards)
+
+    def newId(self):
+        self.counter += 1
+        return '%08x%016x' % (self.start + self.counter, self.counter)
+
+    def text(self, words):
+        return ' '.join(self.rnd.choice(WORDS) for i in range(words))
+
+    def action(self, type, card, data):
+        member = self.rnd.choice(self.members)
+        actionId = self.newId()
+        data = dict(data)
+        data['card'] = {'id' : card['id'], 'name' : card['name'], 'idShort' : card['idShort']}
+        data['board'] = {'id' : self.board['id'], 'name' : self.board['name']}
+        data['list'] = {'id' : self.list['id'], 'name' : self.list['name']}
+        action = {
+            'id' : actionId,
+            'type' : type,
+            'date' : time.strftime('%Y-%m-%dT%H:%M:%S.000Z', time.gmtime(int(actionId[:8], 16))),
+            'idMemberCreator' : member['id'],
+            'memberCreator' : {'id' : member['id'], 'username' : member['username']},
+            'data' : data,
+        }
+        self.actions.append(action)
+        return action
+
+    def newCard(self, idShort, comments, checklists, items, attachments):
+        card = {
+            'id' : self.newId(),
+            'idShort' : idShort,
+            'name' : '(%d) %s' % (self.rnd.randint(1, 8), self.text(5)),
+            'desc' : '\n'.join(self.text(12) for i in range(8)),
+            'url' : 'https://trello.com/c/%d' % idShort,
+            'idBoard' : self.board['id'],
+            'idList' : self.list['id'],
+            'labels' : self.rnd.sample(self.labels, 2),
+            'idMembers' : [],
+            'members' : self.rnd.sample(self.members, 3),
+            'attachments' : [{'name' : 'file%d.txt' % i, 'url' : 'https://example.com/f%d' % i} for i in range(attachments)],
+        }
+        card['idMembers'] = [m['id'] for m in card['members']]
+        card['idLabels'] = [l['id'] for l in card['labels']]
+        card['checklists'] = []
+        for c in range(checklists):
+            card['checklists'].append({
+                'id' : self.newId(), 'name' : 'Checklist %d' % c, 'idCard' : card['id'], 'idBoard' : self.board['id'], 'pos' : c,
+                'checkItems' : [{'id' : self.newId(), 'name' : self.text(4), 'state' : 'incomplete', 'pos' : i} for i in range(items)],
+            })
+        card['idChecklists'] = [c['id'] for c in card['checklists']]
+        actions = [self.action('createCard', card, {})]
+        for i in range(comments):
+            actions.append(self.action('commentCard', card, {'text' : self.text(20)}))
+        # newest first, like Trello
+        actions.reverse()
+        card['actions'] = actions
+        return card
+
+    def commentAction(self, card):
+        return self.action('commentCard', card, {'text' : self.text(20)})
+
+
+# newest first, limit/since/before by id like the Trello actions
+def page(items, params):
+    items = sorted(items, key=lambda i: i['id'], reverse=True)
+    if params.get('since'):
+        items = [i for i in items if i['id'] > params['since']]
+    if params.get('before'):
+        items = [i for i in items if i['id'] < params['before']]
+    return items[:int(params.get('limit', 50))]
+
+
+# the card with the nested resources asked for only
+def nested(card, params):
+    card = dict(card)
+    if 'members' not in params:
+        del card['members']
+    if 'checklists' not in params:
+        del card['checklists']
+    if 'labels' not in params.get('fields', 'labels').split(','):
+        del card['labels']
+    return card
+
+
+class FakeTrelloHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.dispatch('GET')
+
+    def do_POST(self):
+        self.dispatch('POST')
+
+    def dispatch(self, method):
+        parts = urlparse.urlsplit(self.path)
+        params = dict(urlparse.parse_qsl(parts.query))
+        length = int(self.headers.get('Content-Length') or 0)
+        if length:
+            self.rfile.read(length)
+        for routeMethod, pattern, name in self.server.routes:
+            m = pattern.match(parts.path)
+            if routeMethod == method and m:
+                self.server.count(name)
+                status, body = getattr(self.server, name)(params, *m.groups())
+                break
+        else:
+            self.server.count('unknown')
+            status, body = 404, {'message' : 'not found'}
+        content = json.dumps(body)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+
+class FakeTrello(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, data, port=0):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', port), FakeTrelloHandler)
+        self.data = data
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.routes = [(m, re.compile('^/1' + p + '$'), n) for m, p, n in [
+            ('GET', r'/boards/(\w+)', 'getBoard'),
+            ('GET', r'/boards/(\w+)/cards/(\d+)', 'getBoardCard'),
+            ('GET', r'/boards/(\w+)/actions', 'getBoardActions'),
+            ('GET', r'/boards/(\w+)/members', 'getBoardMembers'),
+            ('GET', r'/boards/(\w+)/checklists', 'getBoardChecklists'),
+            ('GET', r'/boards/(\w+)/labels', 'getBoardLabels'),
+            ('GET', r'/lists/(\w+)', 'getList'),
+            ('GET', r'/lists/(\w+)/cards', 'getListCards'),
+            ('GET', r'/cards/(\w+)', 'getCard'),
+            ('GET', r'/cards/(\w+)/actions', 'getCardActions'),
+            ('POST', r'/cards/(\w+)/attachments', 'addAttachment'),
+            ('POST', r'/cards/(\w+)/actions/comments', 'addComment'),
+        ]]
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%d/1' % self.server_address[1]
+
+    def count(self, name):
+        self.lock.acquire()
+        try:
+            self.calls[name] = self.calls.get(name, 0) + 1
+        finally:
+            self.lock.release()
+
+    def resetCalls(self):
+        self.lock.acquire()
+        try:
+            calls = self.calls
+            self.calls = {}
+            return calls
+        finally:
+            self.lock.release()
+
+    def start(self):
+        t = threading.Thread(target=self.serve_forever)
+        t.setDaemon(True)
+        t.start()
+
+    # endpoints
+    def getBoard(self, params, boardId):
+        if boardId != self.data.board['id']:
+            return 404, {}
+        return 200, self.data.board
+
+    def getBoardCard(self, params, boardId, idShort):
+        for c in self.data.cards:
+            if c['idShort'] == int(idShort):
+                return 200, c
+        return 404, {}
+
+    def getBoardActions(self, params, boardId):
+        return 200, page(self.data.actions, params)
+
+    def getBoardMembers(self, params, boardId):
+        return 200, self.data.members
+
+    def getBoardChecklists(self, params, boardId):
+        return 200, [c for card in self.data.cards for c in card['checklists']]
+
+    def getBoardLabels(self, params, boardId):
+        return 200, self.data.labels
+
+    def getList(self, params, listId):
+        if listId != self.data.list['id']:
+            return 404, {}
+        return 200, self.data.list
+
+    def getListCards(self, params, listId):
+        # list position order, no paging
+        return 200, [nested(c, params) for c in self.data.cards]
+
+    def getCard(self, params, cardId):
+        if cardId not in self.data.cardsById:
+            return 404, {}
+        return 200, nested(self.data.cardsById[cardId], params)
+
+    def getCardActions(self, params, cardId):
+        card = self.data.cardsById[cardId]
+        return 200, page([a for a in card['actions'] if a['type'] in params.get('filter', a['type']).split(',')], params)
+
+    def addAttachment(self, params, cardId):
+        return 200, {'id' : self.data.newId(), 'url' : params.get('url'), 'name' : params.get('name')}
+
+    def addComment(self, params, cardId):
+        return 200, {'id' : self.data.newId(), 'type' : 'commentCard', 'data' : {'text' : params.get('text')}}
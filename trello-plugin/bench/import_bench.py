@@ -0,0 +1,61 @@
+'''
+Cold import time of the plugin, as paid by every Trac worker.
+
+    python bench/import_bench.py [runs]
+
+Each run is a fresh interpreter that first imports the Trac modules a
+worker has loaded anyway, then times "import trello" and lists the heavy
+modules the import pulled in. Those should only load when a Trello page,
+ticket hook or trac-admin command uses them; the exit status is 1 if any
+of them is loaded at import time.
+'''
+import os
+import subprocess
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# loaded on first use only
+HEAVY = ['trolly', 'httplib2', 'urllib2', 'httplib', 'dateutil', 'xmlrpclib',
+         'cProfile', 'pstats', 'trelloclient', 'markdowntowiki', 'transport',
+         'pipeline', 'writer', 'ratelimit']
+
+CHILD = '''
+import sys, time
+sys.path.insert(0, %r)
+import trac.core, trac.web, trac.web.chrome, trac.ticket.api, trac.admin.api, trac.env, trac.db
+before = set(sys.modules)
+start = time.time()
+import trello
+elapsed = time.time() - start
+loaded = [m for m in set(sys.modules) - before if sys.modules[m] is not None]
+# plugin modules load as trello.<name>
+names = set(p for m in loaded for p in (m.split('.')[0], m.split('.')[-1]))
+print elapsed, len(loaded), ','.join(sorted(names & set(%r))) or '-'
+'''
+
+
+def run():
+    code = CHILD % (ROOT, HEAVY)
+    out = subprocess.Popen([sys.executable, '-c', code], stdout=subprocess.PIPE).communicate()[0]
+    elapsed, count, heavy = out.split()
+    return float(elapsed), int(count), [h for h in heavy.split(',') if h != '-']
+
+
+def main():
+    runs = 10
+    if len(sys.argv) > 1:
+        runs = int(sys.argv[1])
+    results = [run() for i in range(runs)]
+    times = sorted(r[0] for r in results)
+    print 'import trello: median %.1f ms, min %.1f ms, max %.1f ms over %d runs' % (
+        times[len(times) // 2] * 1000, times[0] * 1000, times[-1] * 1000, runs)
+    print 'modules loaded by the import: %d' % results[0][1]
+    heavy = results[0][2]
+    if heavy:
+        print 'loaded at import time: %s' % ', '.join(heavy)
+        sys.exit(1)
+    print 'no heavy module loaded at import time'
+
+if __name__ == '__main__':
+    main()
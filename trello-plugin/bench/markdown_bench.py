@@ -0,0 +1,92 @@
+'''
+Throughput of the Trello markdown -> Trac wiki converter.
+
+    python bench/markdown_bench.py [repeat]
+
+Runs the converter over a generated corpus of large card descriptions
+and long comment threads and prints MB/s, next to the previous
+four-pass regex implementation.
+'''
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'trello'))
+import markdowntowiki
+
+
+# the converter before the single-pass rewrite
+def legacyConvert(text):
+    text = re.sub('\r\n', '\n', text)
+    text = re.sub(r'\*\*(.*?)\*\*', r"'''\1'''", text)
+    text = re.sub(r'_(.*?)_', r"''\1''", text)
+    text = re.sub(r"\n", r" [[br]]", text)
+    return text
+
+
+WORDS = ['card', 'ticket', 'deploy', 'snake_case_name', 'fix', 'release', 'trac',
+         'trello', 'board', 'review', 'merge', 'http', 'database', 'query']
+
+def sentence(rnd):
+    words = [rnd.choice(WORDS) for i in range(rnd.randint(6, 16))]
+    i = rnd.randint(0, len(words) - 1)
+    words[i] = rnd.choice(['**%s**', '_%s_', '`%s`', '[%s](https://example.com/x)', '~~%s~~']) % words[i]
+    return ' '.join(words).capitalize() + '.'
+
+def description(rnd, size):
+    lines = []
+    length = 0
+    while length < size:
+        kind = rnd.random()
+        if kind < 0.05:
+            line = '## ' + sentence(rnd)
+        elif kind < 0.25:
+            line = '- ' + sentence(rnd)
+        elif kind < 0.30:
+            line = '1. ' + sentence(rnd)
+        elif kind < 0.33:
+            line = '```\nx = snake_case_name(**kwargs)\n```'
+        elif kind < 0.36:
+            line = '> ' + sentence(rnd)
+        elif kind < 0.45:
+            line = ''
+        else:
+            line = sentence(rnd)
+        lines.append(line)
+        length += len(line) + 1
+    return '\n'.join(lines)
+
+def corpus():
+    rnd = random.Random(42)
+    # large descriptions
+    texts = [description(rnd, 20000) for i in range(100)]
+    # long comment threads
+    for thread in range(20):
+        texts.extend(description(rnd, rnd.randint(40, 600)) for i in range(300))
+    return texts
+
+def measure(convert, texts, repeat):
+    size = sum(len(t) for t in texts) * repeat
+    start = time.time()
+    for r in range(repeat):
+        for t in texts:
+            convert(t)
+    elapsed = time.time() - start
+    return size / elapsed / (1024 * 1024), elapsed
+
+def main():
+    repeat = 3
+    if len(sys.argv) > 1:
+        repeat = int(sys.argv[1])
+    texts = corpus()
+    print 'corpus: %d texts, %.1f MB' % (len(texts), sum(len(t) for t in texts) / (1024.0 * 1024))
+    for name, convert in [('single pass', markdowntowiki.convert),
+                          ('facade', lambda t: markdowntowiki.MarkdownToWiki(t).convert()),
+                          ('legacy', legacyConvert)]:
+        mbs, elapsed = measure(convert, texts, repeat)
+        print '%-12s %8.2f MB/s  (%.2fs)' % (name, mbs, elapsed)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,210 @@
+'''
+Offline benchmark of the import and webhook paths.
+
+    python bench/suite.py [cards] [comments]
+
+Starts the fake Trello API of faketrello.py on localhost, creates a
+throwaway SQLite Trac environment per scenario and runs the plugin
+controllers against it:
+
+    index       one list import job of all the cards (POST /trello)
+    single      one POST /trello/single per card
+    sendtotrac  one GET /trello/sendtotrac per card
+    webhook     one commentCard webhook per imported card, until the
+                queue worker has applied them all
+
+For each scenario it prints wall time, Trello API calls per card, SQL
+statements per card and the peak RSS of the process so far.
+'''
+import json
+import logging
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from StringIO import StringIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import trello
+from trello.trello import TrelloToTracPlugin
+from trello.webhookqueue import WebhookQueue
+from trello.jobs import ImportJobs, FINISHED
+from trac.env import Environment
+from trac.web.href import Href
+
+import faketrello
+
+
+class SqlCounter(logging.Handler):
+    # trac logs every statement with [trac] debug_sql enabled
+    def __init__(self):
+        logging.Handler.__init__(self, logging.DEBUG)
+        self.count = 0
+
+    def emit(self, record):
+        if record.getMessage().startswith('SQL'):
+            self.count += 1
+
+
+class BenchRequest(object):
+    def __init__(self, method, args, body=''):
+        self.method = method
+        self.args = dict(args)
+        self.body = StringIO(body)
+        self.headers = {'Content-Length' : str(len(body))}
+        self.perm = set(['TRAC_ADMIN'])
+        self.href = Href('/trac')
+        self.abs_href = Href('http://localhost/trac')
+        self.chrome = {'warnings' : [], 'notices' : [], 'links' : {}, 'scripts' : []}
+        self.remote_addr = '127.0.0.1'
+        self.authname = 'admin'
+        self.status = None
+        self.output = []
+
+    def get_header(self, name):
+        return self.headers.get(name)
+
+    def read(self, size=None):
+        return self.body.read(size)
+
+    def send_response(self, code):
+        self.status = code
+
+    def send_header(self, name, value):
+        pass
+
+    def end_headers(self):
+        pass
+
+    def write(self, data):
+        self.output.append(data)
+
+
+def createEnv(server, data):
+    path = tempfile.mkdtemp(prefix='trello-bench-')
+    options = [
+        ('trac', 'database', 'sqlite:db/trac.db'),
+        ('trac', 'debug_sql', 'true'),
+        ('logging', 'log_type', 'none'),
+        ('logging', 'log_level', 'DEBUG'),
+        ('components', 'trello.*', 'enabled'),
+        ('project', 'url', 'http://localhost/trac/'),
+        ('trello', 'api_key', 'bench'),
+        ('trello', 'user_auth_token', 'bench'),
+        ('trello', 'api_url', server.url),
+        ('trello', 'boards', data.board['id']),
+        ('trello', 'lists', data.list['id']),
+        ('trello', 'agile_trac', 'false'),
+    ]
+    env = Environment(os.path.join(path, 'env'), create=True, options=options)
+    db = env.get_db_cnx()
+    cursor = db.cursor()
+    cursor.execute("INSERT INTO milestone (name, due, completed, description) VALUES ('bench', 0, 0, '')")
+    db.commit()
+    counter = SqlCounter()
+    env.log.addHandler(counter)
+    return path, env, counter
+
+
+# the form queues a job, wait for the job worker to finish it
+def importList(plugin, data):
+    req = BenchRequest('POST', {'board' : data.board['id'], 'thelist' : data.list['id'], 'milestone' : 'bench'})
+    template, result, type = plugin.indexController(req)
+    if req.chrome['warnings']:
+        raise Exception(req.chrome['warnings'][0])
+    jobs = ImportJobs(plugin.env)
+    while True:
+        job = jobs.getJob(result['job'])
+        if job['status'] in FINISHED:
+            break
+        time.sleep(0.05)
+    if job['status'] != 'done':
+        raise Exception('Import job %s: %s' % (job['status'], job['error']))
+
+
+def runIndex(plugin, data):
+    importList(plugin, data)
+
+
+def runSingle(plugin, data):
+    for card in data.cards:
+        req = BenchRequest('POST', {'board' : data.board['id'], 'card' : str(card['idShort']), 'milestone' : 'bench'})
+        plugin.singleController(req)
+        if req.chrome['warnings']:
+            raise Exception(req.chrome['warnings'][0])
+
+
+def runSendToTrac(plugin, data):
+    for card in data.cards:
+        req = BenchRequest('GET', {'board' : data.board['id'], 'card' : card['id'], 'milestone' : 'bench'})
+        plugin.sendToTracController(req)
+
+
+def prepareWebhook(plugin, data):
+    importList(plugin, data)
+
+
+def runWebhook(plugin, data):
+    for card in data.cards:
+        body = json.dumps({'action' : data.commentAction(card)})
+        plugin.webhookController(BenchRequest('POST', {}, body))
+    queue = WebhookQueue(plugin.env)
+    deadline = time.time() + 600
+    while time.time() < deadline:
+        depth = queue.getDepth()
+        if depth['pending'] + depth['processing'] == 0:
+            break
+        time.sleep(0.05)
+
+
+SCENARIOS = [
+    ('index', None, runIndex),
+    ('single', None, runSingle),
+    ('sendtotrac', None, runSendToTrac),
+    ('webhook', prepareWebhook, runWebhook),
+]
+
+
+def peakRss():
+    # kilobytes on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def main():
+    cards = 50
+    comments = 10
+    if len(sys.argv) > 1:
+        cards = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        comments = int(sys.argv[2])
+
+    data = faketrello.FakeData(cards, comments)
+    server = faketrello.FakeTrello(data)
+    server.start()
+    print '%d cards, %d comments per card, fake api on %s' % (cards, comments, server.url)
+    print '%-12s %9s %10s %10s %10s' % ('scenario', 'wall s', 'api/card', 'sql/card', 'peak MB')
+
+    for name, prepare, run in SCENARIOS:
+        path, env, counter = createEnv(server, data)
+        try:
+            plugin = TrelloToTracPlugin(env)
+            if prepare is not None:
+                prepare(plugin, data)
+            server.resetCalls()
+            counter.count = 0
+            start = time.time()
+            run(plugin, data)
+            elapsed = time.time() - start
+            calls = server.resetCalls()
+            print '%-12s %9.2f %10.1f %10.1f %10.1f' % (name, elapsed, sum(calls.values()) / float(cards), counter.count / float(cards), peakRss())
+            print '             ' + ', '.join('%s=%d' % c for c in sorted(calls.items()))
+        finally:
+            env.shutdown()
+            shutil.rmtree(path, ignore_errors=True)
+
+    server.shutdown()
+
+if __name__ == '__main__':
+    main()
@@ -1 +1,3 @@
 from trello import trello
+from trello import schema
+from trello import admin
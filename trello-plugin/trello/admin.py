@@ -0,0 +1,200 @@
+import time
+
+from trac.core import *
+from trac.admin.api import IAdminCommandProvider, AdminCommandError
+from trac.util.text import printout
+
+from trello import TrelloToTracPlugin
+from sync import TrelloSync
+from members import MemberDirectory
+import metrics
+
+
+class TrelloAdmin(Component):
+
+    implements(IAdminCommandProvider)
+
+    # IAdminCommandProvider methods
+    def get_admin_commands(self):
+        yield ('trello import', '<milestone> [iteration] [--restart]',
+               """Import every card of the lists in [trello] lists
+
+               The import records a checkpoint after every committed batch
+               and resumes from it, --restart forgets the checkpoints.""",
+               None, self.importCommand)
+        yield ('trello sync', '<milestone> [iteration]',
+               """Apply the Trello actions since the last sync of each board
+
+               New cards of the configured lists become tickets in the
+               milestone, comments, renames, description edits and list
+               moves update the existing tickets.""",
+               None, self.syncCommand)
+        yield ('trello import-export', '<file> <milestone> [iteration]',
+               """Import the cards of a Trello board JSON export
+
+               The export is read incrementally and needs no network
+               access. Open cards of the lists in [trello] lists are
+               imported, or all open cards when none of them is in the
+               export. Cards already imported are skipped.""",
+               None, self.importExportCommand)
+
+    def importCommand(self, milestone, *args):
+        restart = '--restart' in args
+        args = [a for a in args if a != '--restart']
+        plugin = TrelloToTracPlugin(self.env)
+        iteration = self.getIteration(plugin, milestone, args)
+
+        if restart:
+            self.clearCheckpoints()
+
+        trello = plugin.getTrelloClient()
+        boardList = self.config.getlist('trello', 'boards')
+        listList = self.config.getlist('trello', 'lists')
+
+        # lists grouped by the configured board they belong to
+        listsByBoard = {}
+        for listId in listList:
+            result = trello.listExist(listId)
+            if not result['res']:
+                printout('List %s is not exist, skipped.' % listId)
+            elif result['boardId'] not in boardList:
+                printout('List %s is not in a configured board, skipped.' % listId)
+            else:
+                listsByBoard.setdefault(result['boardId'], []).append(listId)
+
+        for boardId in boardList:
+            if not listsByBoard.get(boardId):
+                continue
+            # labels, members and checklists fetched once for all its lists
+            context = plugin.getBoardContext(boardId, trello)
+            for listId in listsByBoard[boardId]:
+                self.importList(plugin, trello, boardId, listId, milestone, iteration, context)
+
+    def importExportCommand(self, path, milestone, *args):
+        from export import ExportIndex, ExportError
+        import trelloclient
+        plugin = TrelloToTracPlugin(self.env)
+        iteration = self.getIteration(plugin, milestone, args)
+
+        index = ExportIndex()
+        try:
+            f = open(path, 'rb')
+            try:
+                index.load(f)
+            except ExportError, e:
+                raise AdminCommandError('%s: %s' % (path, e))
+            finally:
+                f.close()
+            boardId = index.board.get('id')
+            printout('Board "%s": %d cards, %d checklists, %d comments' % (index.board.get('name'), index.counts['cards'], index.counts['checklists'], index.counts['comments']))
+
+            listIds = [l for l in self.config.getlist('trello', 'lists') if l in index.lists]
+            if listIds:
+                printout('Importing lists %s' % ', '.join(index.lists[l] for l in listIds))
+            else:
+                listIds = None
+                printout('No configured list in the export, importing every open card')
+
+            # users from the export members for the whole command, no board members fetch
+            MemberDirectory(self.env).pinBoardMembers(boardId, index.members.values())
+            bundles = (trelloclient.TrelloCardBundle(c) for c in index.iterCards(listIds))
+            added = skipped = 0
+            for result in plugin.importCardBundles(bundles, milestone, iteration, None):
+                if result['res']:
+                    added += 1
+                    printout('Added card "%s" with id: %s' % (result['name'], result['id']))
+                else:
+                    skipped += 1
+                    printout(result['msg'])
+            printout('%d tickets added, %d cards skipped' % (added, skipped))
+        finally:
+            if index.board.get('id'):
+                MemberDirectory(self.env).unpinBoardMembers(index.board['id'])
+            index.close()
+
+    def syncCommand(self, milestone, *args):
+        plugin = TrelloToTracPlugin(self.env)
+        iteration = self.getIteration(plugin, milestone, args)
+        trello = plugin.getTrelloClient(background=True)
+        listList = self.config.getlist('trello', 'lists')
+        for boardId in self.config.getlist('trello', 'boards'):
+            stats = TrelloSync(self.env).syncBoard(boardId, listList, milestone, iteration, trello)
+            printout('Board %s: %d new cards, %d comments, %d renames, %d descriptions, %d moves' % (boardId, stats['cards'], stats['comments'], stats['renames'], stats['descriptions'], stats['moves']))
+
+    # validate milestone and iteration arguments
+    def getIteration(self, plugin, milestone, args):
+        iteration = None
+        if len(args):
+            iteration = args[0]
+        result = plugin.validateMilestone(milestone)
+        if not result['res']:
+            raise AdminCommandError(result['msg'])
+        if self.config.getbool('trello', 'agile_trac'):
+            if iteration is None:
+                raise AdminCommandError('Iteration is required when agile_trac is enabled.')
+            result = plugin.validateIteration(iteration)
+            if not result['res']:
+                raise AdminCommandError(result['msg'])
+        return iteration
+
+    def importList(self, plugin, trello, boardId, listId, milestone, iteration, context=None):
+        import trelloclient
+        checkpoint = self.getCheckpoint(listId)
+        if checkpoint['status'] == 'done':
+            printout('List %s of board %s already imported.' % (listId, boardId))
+            return
+        printout('Importing list %s of board %s' % (listId, boardId))
+
+        cards = trelloclient.TrelloList(trello, listId).getCardList(context)
+        if checkpoint['card'] is not None:
+            ids = [c['id'] for c in cards]
+            if checkpoint['card'] in ids:
+                cards = cards[ids.index(checkpoint['card']) + 1:]
+                printout('Resuming after %d cards' % checkpoint['done'])
+        bundles = trelloclient.iterBundles(trello, cards, context)
+        done = checkpoint['done']
+
+        def save(cursor, cardId, count):
+            self.saveCheckpoint(cursor, listId, cardId, done + count, 'running')
+
+        added = 0
+        failed = 0
+        count = 0
+        for result in plugin.importCardBundles(bundles, milestone, iteration, trello, save):
+            count += 1
+            if result['res']:
+                added += 1
+                printout('Added card "%s" with id: %s' % (result['name'], result['id']))
+            else:
+                if not result.get('skipped'):
+                    failed += 1
+                printout(result['msg'])
+
+        if failed:
+            # the checkpoint stays before the first failed card
+            printout('List %s: %d tickets added, %d cards failed, run the command again to retry them' % (listId, added, failed))
+            return
+        db = self.env.get_db_cnx()
+        cursor = metrics.cursor(db)
+        self.saveCheckpoint(cursor, listId, None, done + count, 'done')
+        db.commit()
+        printout('List %s: %d tickets added' % (listId, added))
+
+    def getCheckpoint(self, listId):
+        db = self.env.get_db_cnx()
+        cursor = metrics.cursor(db)
+        cursor.execute("SELECT card, done, status FROM trello_import_checkpoint WHERE list = %s", [listId])
+        row = cursor.fetchone()
+        if row is None:
+            return {'card' : None, 'done' : 0, 'status' : None}
+        return {'card' : row[0], 'done' : row[1], 'status' : row[2]}
+
+    def saveCheckpoint(self, cursor, listId, cardId, done, status):
+        cursor.execute("DELETE FROM trello_import_checkpoint WHERE list = %s", [listId])
+        cursor.execute("INSERT INTO trello_import_checkpoint (list, card, done, status, updated) VALUES ((%s),(%s),(%s),(%s),(%s))", [listId, cardId, done, status, int(time.time())])
+
+    def clearCheckpoints(self):
+        db = self.env.get_db_cnx()
+        cursor = metrics.cursor(db)
+        cursor.execute("DELETE FROM trello_import_checkpoint")
+        db.commit()
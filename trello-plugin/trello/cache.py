@@ -0,0 +1,121 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class TtlCache(object):
+    # bounded LRU with expiry; a hit in the last part of the ttl
+    # (after refreshAhead * ttl seconds) returns the cached value and
+    # reloads it on a background thread
+    def __init__(self, maxSize=256, ttl=300, refreshAhead=0.8):
+        self.maxSize = max(1, int(maxSize))
+        self.ttl = ttl
+        self.refreshAhead = refreshAhead
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.refreshing = set()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, loader):
+        now = time.time()
+        self.lock.acquire()
+        try:
+            entry = self.entries.pop(key, None)
+            if entry is not None and now - entry[1] < self.ttl:
+                self.entries[key] = entry
+                self.hits += 1
+                refresh = now - entry[1] >= self.ttl * self.refreshAhead and key not in self.refreshing
+                if refresh:
+                    self.refreshing.add(key)
+            else:
+                self.misses += 1
+                entry = None
+        finally:
+            self.lock.release()
+
+        if entry is None:
+            value = loader()
+            self.set(key, value)
+            return value
+        if refresh:
+            t = threading.Thread(target=self.reload, args=(key, loader))
+            t.setDaemon(True)
+            t.start()
+        return entry[0]
+
+    def reload(self, key, loader):
+        try:
+            self.set(key, loader())
+        except Exception:
+            # keep serving the cached value until it expires
+            pass
+        finally:
+            self.lock.acquire()
+            self.refreshing.discard(key)
+            self.lock.release()
+
+    def set(self, key, value):
+        self.lock.acquire()
+        try:
+            self.entries.pop(key, None)
+            self.entries[key] = (value, time.time())
+            while len(self.entries) > self.maxSize:
+                self.entries.popitem(last=False)
+        finally:
+            self.lock.release()
+
+    def invalidate(self, key=None):
+        self.lock.acquire()
+        try:
+            if key is None:
+                self.entries.clear()
+            else:
+                self.entries.pop(key, None)
+        finally:
+            self.lock.release()
+
+    def stats(self):
+        self.lock.acquire()
+        try:
+            return {'size' : len(self.entries), 'hits' : self.hits, 'misses' : self.misses}
+        finally:
+            self.lock.release()
+
+
+class LruCache(object):
+    # bounded LRU without expiry, for values derived from their key
+    def __init__(self, maxSize=2048):
+        self.maxSize = max(1, int(maxSize))
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, loader):
+        self.lock.acquire()
+        try:
+            if key in self.entries:
+                value = self.entries.pop(key)
+                self.entries[key] = value
+                self.hits += 1
+                return value
+            self.misses += 1
+        finally:
+            self.lock.release()
+        value = loader()
+        self.lock.acquire()
+        try:
+            self.entries[key] = value
+            while len(self.entries) > self.maxSize:
+                self.entries.popitem(last=False)
+        finally:
+            self.lock.release()
+        return value
+
+    def stats(self):
+        self.lock.acquire()
+        try:
+            return {'size' : len(self.entries), 'hits' : self.hits, 'misses' : self.misses}
+        finally:
+            self.lock.release()
@@ -0,0 +1,156 @@
+import json
+import os
+import re
+import shutil
+import sqlite3
+import tempfile
+
+CHUNK = 65536
+SPACE = re.compile(r'[ \t\n\r]*')
+
+
+class ExportError(Exception):
+    pass
+
+
+class StreamDecoder(object):
+    # decodes one JSON value at a time from a file, keeping only the
+    # unread part of the current value in memory
+    def __init__(self, f, chunkSize=CHUNK):
+        self.f = f
+        self.chunkSize = chunkSize
+        self.decoder = json.JSONDecoder()
+        self.buf = ''
+        self.pos = 0
+        self.offset = 0
+        self.eof = False
+
+    # read at least size more bytes, False at the end of the file
+    def fill(self, size=None):
+        self.offset += self.pos
+        self.buf = self.buf[self.pos:]
+        self.pos = 0
+        chunk = self.f.read(max(size or 0, self.chunkSize))
+        if not chunk:
+            self.eof = True
+            return False
+        self.buf += chunk
+        return True
+
+    def skipSpace(self):
+        while True:
+            self.pos = SPACE.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf) or not self.fill():
+                return
+
+    def peek(self):
+        self.skipSpace()
+        if self.pos >= len(self.buf):
+            raise ExportError('Unexpected end of the export at byte %d' % (self.offset + self.pos))
+        return self.buf[self.pos]
+
+    def expect(self, chars):
+        c = self.peek()
+        if c not in chars:
+            raise ExportError('Expected %s at byte %d, found %r' % (' or '.join(repr(x) for x in chars), self.offset + self.pos, c))
+        self.pos += 1
+        return c
+
+    def value(self):
+        self.skipSpace()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+                # a number at the end of the buffer may go on in the next chunk
+                if end < len(self.buf) or self.eof:
+                    self.pos = end
+                    return value
+            except ValueError, e:
+                if self.eof:
+                    raise ExportError('Invalid JSON at byte %d: %s' % (self.offset + self.pos, e))
+            # read as much again, a big value is decoded a few times only
+            self.fill(len(self.buf) - self.pos)
+
+
+# (key, value) for every member of the top level object, arrays are
+# yielded element by element with the key of the array
+def iterExport(f, chunkSize=CHUNK):
+    reader = StreamDecoder(f, chunkSize)
+    reader.expect('{')
+    if reader.peek() == '}':
+        return
+    while True:
+        key = reader.value()
+        reader.expect(':')
+        if reader.peek() == '[':
+            reader.pos += 1
+            if reader.peek() == ']':
+                reader.pos += 1
+            else:
+                while True:
+                    yield key, reader.value()
+                    if reader.expect(',]') == ']':
+                        break
+        else:
+            yield key, reader.value()
+        if reader.expect(',}') == '}':
+            return
+
+
+class ExportIndex(object):
+    # cards, checklists and card actions of a board export indexed by card
+    # in a temporary sqlite file, members and lists stay in memory
+    def __init__(self):
+        self.dir = tempfile.mkdtemp(prefix='trello-export-')
+        self.db = sqlite3.connect(os.path.join(self.dir, 'index.db'))
+        self.db.text_factory = str
+        self.db.execute("CREATE TABLE card (seq INTEGER PRIMARY KEY, id TEXT, list TEXT, closed INTEGER, json TEXT)")
+        self.db.execute("CREATE TABLE checklist (card TEXT, json TEXT)")
+        self.db.execute("CREATE TABLE action (card TEXT, json TEXT)")
+        self.board = {}
+        self.members = {}
+        self.lists = {}
+        self.counts = {'cards' : 0, 'checklists' : 0, 'comments' : 0}
+
+    def load(self, f):
+        for key, value in iterExport(f):
+            if key == 'cards':
+                self.db.execute("INSERT INTO card (id, list, closed, json) VALUES (?, ?, ?, ?)",
+                                [value['id'], value.get('idList'), int(bool(value.get('closed'))), json.dumps(value)])
+                self.counts['cards'] += 1
+            elif key == 'checklists':
+                self.db.execute("INSERT INTO checklist (card, json) VALUES (?, ?)", [value.get('idCard'), json.dumps(value)])
+                self.counts['checklists'] += 1
+            elif key == 'actions':
+                if value.get('type') in ('commentCard', 'createCard') and 'card' in value.get('data', {}):
+                    self.db.execute("INSERT INTO action (card, json) VALUES (?, ?)", [value['data']['card']['id'], json.dumps(value)])
+                    if value['type'] == 'commentCard':
+                        self.counts['comments'] += 1
+            elif key == 'members':
+                self.members[value['id']] = {'id' : value['id'], 'username' : value.get('username'), 'fullName' : value.get('fullName')}
+            elif key == 'lists':
+                self.lists[value['id']] = value.get('name')
+            elif not isinstance(value, (dict, list)):
+                self.board[key] = value
+        self.db.execute("CREATE INDEX checklist_card ON checklist (card)")
+        self.db.execute("CREATE INDEX action_card ON action (card)")
+        self.db.commit()
+
+    # open cards of the lists (all lists if None) in export order, shaped
+    # like the cards of TrelloList.getCardBundles
+    def iterCards(self, listIds=None):
+        cursor = self.db.cursor()
+        cursor.execute("SELECT json FROM card WHERE closed = 0 ORDER BY seq")
+        for row in cursor:
+            card = json.loads(row[0])
+            if listIds is not None and card.get('idList') not in listIds:
+                continue
+            card['members'] = [self.members[id] for id in card.get('idMembers', []) if id in self.members]
+            card['checklists'] = [json.loads(c) for c, in self.db.execute("SELECT json FROM checklist WHERE card = ?", [card['id']])]
+            card['actions'] = [json.loads(a) for a, in self.db.execute("SELECT json FROM action WHERE card = ?", [card['id']])]
+            card.setdefault('attachments', [])
+            yield card
+
+    def close(self):
+        self.db.close()
+        shutil.rmtree(self.dir, ignore_errors=True)
@@ -0,0 +1,117 @@
+import time
+
+from trac.core import *
+
+import metrics
+from workqueue import WorkQueue
+
+FINISHED = ('done', 'cancelled', 'failed')
+COLUMNS = ['id', 'board', 'list', 'milestone', 'iteration', 'author', 'status', 'total', 'done', 'skipped', 'failed', 'cancel', 'created', 'started', 'updated', 'finished', 'error', 'stage']
+
+
+class ImportJobs(WorkQueue):
+    # list imports queued by the web form and run one at a time by a
+    # background worker; progress and cancellation go through the
+    # trello_import_job table so any trac process can report on a job
+    table = 'trello_import_job'
+    workerName = 'trello-import-jobs'
+    pollOption = 'job_poll_interval'
+    pendingStatus = 'queued'
+    claimedStatus = 'running'
+    # a running job not updated for this long belongs to a dead worker
+    claimColumn = 'updated'
+    retries = False
+
+    # stage is the token of previewed cards, None to fetch the list
+    def create(self, boardId, listId, milestone, iteration, author, stage=None):
+        now = int(time.time())
+        db = self.env.get_db_cnx()
+        cursor = metrics.cursor(db)
+        cursor.execute("INSERT INTO trello_import_job (board, list, milestone, iteration, author, status, total, done, skipped, failed, cancel, created, updated, stage) VALUES ((%s),(%s),(%s),(%s),(%s),'queued',0,0,0,0,0,(%s),(%s),(%s))", [boardId, listId, milestone, iteration, author, now, now, stage])
+        idJob = db.get_last_id(cursor, 'trello_import_job')
+        db.commit()
+        self.wakeup.set()
+        return idJob
+
+    # the handler of ensureWorker, handler(job, report), imports the list
+    # of the job and returns 'done' or 'cancelled', report(counts) returns
+    # False once cancelled
+    def drain(self):
+        if self.runNext():
+            return 1
+        return 0
+
+    def runNext(self):
+        job = self.claim()
+        if job is None:
+            return False
+        state = {'last' : 0}
+
+        def report(counts, final=False):
+            now = time.time()
+            if not final and now - state['last'] < 1:
+                return True
+            state['last'] = now
+            return self.update(job['id'], counts)
+
+        try:
+            status = self.handler(job, report)
+        except Exception, e:
+            self.log.error('Trello import job %s failed: %s', job['id'], e)
+            self.finish(job['id'], 'failed', unicode(e))
+        else:
+            self.finish(job['id'], status)
+        return True
+
+    def claim(self):
+        now = int(time.time())
+        db = self.env.get_db_cnx()
+        cursor = metrics.cursor(db)
+        # a stale job is resumed from the start, imported cards are skipped
+        claimed = self.claimRows(cursor, [], 1, now)
+        for idJob, in claimed:
+            cursor.execute("UPDATE trello_import_job SET started = %s WHERE id = %s", [now, idJob])
+        db.commit()
+        if not claimed:
+            return None
+        return self.getJob(claimed[0][0])
+
+    def update(self, idJob, counts):
+        db = self.env.get_db_cnx()
+        cursor = metrics.cursor(db)
+        cursor.execute("UPDATE trello_import_job SET total = %s, done = %s, skipped = %s, failed = %s, updated = %s WHERE id = %s", [counts['total'], counts['done'], counts['skipped'], counts['failed'], int(time.time()), idJob])
+        cursor.execute("SELECT cancel FROM trello_import_job WHERE id = %s", [idJob])
+        row = cursor.fetchone()
+        db.commit()
+        return not (row and row[0])
+
+    def finish(self, idJob, status, error=None):
+        now = int(time.time())
+        db = self.env.get_db_cnx()
+        cursor = metrics.cursor(db)
+        cursor.execute("UPDATE trello_import_job SET status = %s, error = %s, updated = %s, finished = %s WHERE id = %s", [status, error, now, now, idJob])
+        db.commit()
+
+    def cancel(self, idJob):
+        db = self.env.get_db_cnx()
+        cursor = metrics.cursor(db)
+        cursor.execute("UPDATE trello_import_job SET cancel = 1 WHERE id = %s", [idJob])
+        # a queued job never starts
+        cursor.execute("UPDATE trello_import_job SET status = 'cancelled', finished = %s WHERE id = %s AND status = 'queued'", [int(time.time()), idJob])
+        db.commit()
+        return self.getJob(idJob)
+
+    def getJob(self, idJob):
+        db = self.env.get_db_cnx()
+        cursor = metrics.cursor(db)
+        cursor.execute("SELECT " + ', '.join(COLUMNS) + " FROM trello_import_job WHERE id = %s", [idJob])
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        job = dict(zip(COLUMNS, row))
+        job['processed'] = job['done'] + job['skipped'] + job['failed']
+        job['eta'] = None
+        if job['status'] == 'running' and job['started'] and 0 < job['processed'] < job['total']:
+            elapsed = job['updated'] - job['started']
+            job['eta'] = int(round(float(elapsed) / job['processed'] * (job['total'] - job['processed'])))
+        return job
@@ -1,20 +1,119 @@
 import re
 
+FENCE = re.compile(r'^\s*(```|~~~)')
+HEADER = re.compile(r'^(#{1,6})\s+(.*?)\s*#*\s*$')
+BULLET = re.compile(r'^(\s*)[-*+]\s+(.*)$')
+NUMBERED = re.compile(r'^(\s*)\d+[.)]\s+(.*)$')
+QUOTE = re.compile(r'^\s*>\s?(.*)$')
+RULE = re.compile(r'^\s*([-*_])(\s*\1){2,}\s*$')
+
+# one alternation, scanned once per line
+INLINE = re.compile(r'''
+    (?=[`*_~\[!])
+    (?:`(?P<code>[^`]+)`
+  | !\[(?P<alt>[^\]]*)\]\((?P<src>[^)\s]+)(?:\s+"[^"]*")?\)
+  | \*\*(?P<bold>\S(?:.*?\S)?)\*\*
+  | (?<!\w)__(?P<bold2>\S(?:.*?\S)?)__(?!\w)
+  | ~~(?P<strike>\S(?:.*?\S)?)~~
+  | \[(?P<text>[^\]]+)\]\((?P<url>[^)\s]+)(?:\s+"[^"]*")?\)
+  | (?<![\w*])\*(?P<em>[^*\s](?:[^*]*?[^*\s])?)\*(?![\w*])
+  | (?<!\w)_(?P<em2>[^_\s](?:[^_]*?[^_\s])?)_(?!\w))
+''', re.X)
+
+
+INLINE_MARKS = re.compile(r'[`*_~\[!]')
+
+
+def replaceInline(m):
+    kind = m.lastgroup
+    if kind == 'code':
+        return '{{{' + m.group('code') + '}}}'
+    if kind in ('bold', 'bold2'):
+        return "'''" + convertInline(m.group(kind)) + "'''"
+    if kind in ('em', 'em2'):
+        return "''" + convertInline(m.group(kind)) + "''"
+    if kind == 'strike':
+        return '~~' + convertInline(m.group('strike')) + '~~'
+    if kind == 'src':
+        # pasted images, ![image.png](url)
+        return '[[Image(' + m.group('src') + ')]]'
+    # link
+    return '[' + m.group('url') + ' ' + convertInline(m.group('text')) + ']'
+
+
+def convertInline(text):
+    if INLINE_MARKS.search(text) is None:
+        return text
+    return INLINE.sub(replaceInline, text)
+
+
+# block element of a line, None for paragraph text
+def convertBlock(line):
+    stripped = line.lstrip()
+    if not stripped:
+        return ''
+    first = stripped[0]
+    if first in '`~' and FENCE.match(line):
+        return '{{{'
+    if first in '-*_' and RULE.match(line):
+        return '----'
+    if first == '#':
+        m = HEADER.match(line)
+        if m:
+            level = '=' * len(m.group(1))
+            return level + ' ' + convertInline(m.group(2)) + ' ' + level
+    if first in '-*+':
+        m = BULLET.match(line)
+        if m:
+            return ' ' * (len(m.group(1).expandtabs(4)) // 2 * 2 + 1) + '* ' + convertInline(m.group(2))
+    if first.isdigit():
+        m = NUMBERED.match(line)
+        if m:
+            return ' ' * (len(m.group(1).expandtabs(4)) // 2 * 2 + 1) + '1. ' + convertInline(m.group(2))
+    if first == '>':
+        return '  ' + convertInline(QUOTE.match(line).group(1))
+    return None
+
+
+# Trello markdown to Trac wiki in one pass over the lines
+def convert(text):
+    out = []
+    paragraph = []
+    inCode = False
+    for line in text.replace('\r\n', '\n').split('\n'):
+        if inCode:
+            if FENCE.match(line):
+                out.append('}}}')
+                inCode = False
+            else:
+                out.append(line)
+            continue
+
+        block = convertBlock(line)
+        if block is None:
+            # plain text, lines of a paragraph keep their breaks
+            paragraph.append(convertInline(line))
+            continue
+        if paragraph:
+            out.append(' [[br]]\n'.join(paragraph))
+            paragraph = []
+        out.append(block)
+        if block == '{{{':
+            inCode = True
+
+    if paragraph:
+        out.append(' [[br]]\n'.join(paragraph))
+    if inCode:
+        out.append('}}}')
+    return '\n'.join(out)
+
 
 class MarkdownToWiki():
     text = ''
 
     def __init__(self, text):
         self.text = text
-        
+
     def convert(self):
-        text = self.text
-        text = re.sub('\r\n', '\n', text)
-        #bold
-        text = re.sub(r'\*\*(.*?)\*\*',r"'''\1'''", text)
-        #italics
-        text = re.sub(r'_(.*?)_',r"''\1''", text)
-        #make BR
-        text = re.sub(r"\n",r" [[br]]", text)
-        self.text = text
+        self.text = convert(self.text)
         return self.text
@@ -0,0 +1,138 @@
+import os
+import threading
+import time
+
+from trac.core import *
+
+import metrics
+
+
+class MemberDirectory(Component):
+    # Trello member id -> Trac user, from [trello-user] first, then by
+    # matching the members of the board (one fetch per board) with the
+    # usernames and emails of Trac sessions; everything is dropped when
+    # trac.ini changes
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.mtime = None
+        self.configured = None
+        self.boards = {}
+        # boardId -> (members, directory), boards without API access
+        self.pinned = {}
+
+    def getUser(self, trelloId, boardId=None, getClient=None):
+        if not trelloId:
+            return None
+        user = self.checkConfig().get(trelloId)
+        if user or boardId is None or getClient is None:
+            return user or None
+        return self.getBoard(boardId, getClient).get(trelloId)
+
+    # the [trello-user] mapping, read again when trac.ini changes
+    def checkConfig(self):
+        try:
+            mtime = os.path.getmtime(self.config.filename)
+        except (OSError, TypeError):
+            mtime = None
+        self.lock.acquire()
+        try:
+            if self.configured is None or mtime != self.mtime:
+                self.mtime = mtime
+                self.configured = dict((id, user.strip()) for id, user in self.config.options('trello-user') if user.strip())
+                self.boards = {}
+                self.unbuildPinned()
+            return self.configured
+        finally:
+            self.lock.release()
+
+    # [trello-user] is read again by the next checkConfig, configured stays
+    # set for the lookups running meanwhile
+    def invalidate(self):
+        self.lock.acquire()
+        try:
+            self.mtime = object()
+            self.boards = {}
+            self.unbuildPinned()
+        finally:
+            self.lock.release()
+
+    # pinned members stay, their directory is built again
+    def unbuildPinned(self):
+        self.pinned = dict((boardId, (members, None)) for boardId, (members, directory) in self.pinned.items())
+
+    def getBoard(self, boardId, getClient):
+        ttl = self.config.getint('trello', 'member_cache_ttl', 3600)
+        self.lock.acquire()
+        try:
+            if boardId in self.pinned:
+                members, directory = self.pinned[boardId]
+                if directory is None:
+                    directory = self.buildDirectory(members)
+                    self.pinned[boardId] = (members, directory)
+                return directory
+            entry = self.boards.get(boardId)
+            if entry is None or time.time() - entry[1] > ttl:
+                # under the lock, the import workers share one fetch
+                entry = self.boards[boardId] = (self.loadBoard(boardId, getClient), time.time())
+            return entry[0]
+        finally:
+            self.lock.release()
+
+    def loadBoard(self, boardId, getClient):
+        import trelloclient
+        try:
+            members = trelloclient.TrelloBoard(getClient(), boardId).getMemberList()
+        except Exception, e:
+            # unmapped until the entry expires, rather than one failing call per lookup
+            self.log.warning('Trello members of board %s not loaded: %s', boardId, e)
+            return {}
+        return self.buildDirectory(members)
+
+    # members of a board read without the API (a board export), used
+    # without expiry or fetch until unpinned
+    def pinBoardMembers(self, boardId, members):
+        self.checkConfig()
+        self.lock.acquire()
+        try:
+            self.pinned[boardId] = (list(members), self.buildDirectory(members))
+        finally:
+            self.lock.release()
+
+    def unpinBoardMembers(self, boardId):
+        self.lock.acquire()
+        try:
+            self.pinned.pop(boardId, None)
+        finally:
+            self.lock.release()
+
+    # for members fetched with other board data, e.g. a TrelloBoardContext
+    def setBoardMembers(self, boardId, members):
+        self.checkConfig()
+        self.lock.acquire()
+        try:
+            self.boards[boardId] = (self.buildDirectory(members), time.time())
+        finally:
+            self.lock.release()
+
+    def buildDirectory(self, members):
+        usernames, emails = self.getSessionUsers()
+        directory = {}
+        for m in members:
+            user = self.configured.get(m['id'])
+            if not user and m.get('username'):
+                user = usernames.get(m['username'].lower())
+            if not user and m.get('email'):
+                user = emails.get(m['email'].lower())
+            if user:
+                directory[m['id']] = user
+        return directory
+
+    def getSessionUsers(self):
+        db = self.env.get_db_cnx()
+        cursor = metrics.cursor(db)
+        cursor.execute("SELECT sid FROM session WHERE authenticated = 1")
+        usernames = dict((sid.lower(), sid) for sid, in cursor.fetchall())
+        cursor.execute("SELECT sid, value FROM session_attribute WHERE authenticated = 1 AND name = 'email'")
+        emails = dict((value.strip().lower(), sid) for sid, value in cursor.fetchall() if value)
+        return usernames, emails
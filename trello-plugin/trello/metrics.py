@@ -0,0 +1,177 @@
+import re
+import threading
+import time
+
+# seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+IDS = re.compile(r'/(?:[0-9a-f]{24}|\d+)(?=/|$)')
+SQL_VERB = re.compile(r'^\s*(\w+)')
+SQL_TABLE = re.compile(r'\b(?:FROM|INTO|UPDATE|TABLE)\s+(\w+)', re.I)
+
+
+class Histogram(object):
+    def __init__(self, name, help, labels, buckets=BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self.series = {}
+
+    def observe(self, values, seconds):
+        series = self.series.get(values)
+        if series is None:
+            series = self.series[values] = [[0] * len(self.buckets), 0.0, 0]
+        for i, bound in enumerate(self.buckets):
+            if seconds <= bound:
+                series[0][i] += 1
+        series[1] += seconds
+        series[2] += 1
+
+    def render(self):
+        lines = ['# HELP %s %s' % (self.name, self.help), '# TYPE %s histogram' % self.name]
+        for values in sorted(self.series):
+            counts, total, count = self.series[values]
+            labels = formatLabels(self.labels, values)
+            for bound, n in zip(self.buckets, counts):
+                lines.append('%s_bucket{%s} %d' % (self.name, joinLabels(labels, 'le="%s"' % bound), n))
+            lines.append('%s_bucket{%s} %d' % (self.name, joinLabels(labels, 'le="+Inf"'), count))
+            lines.append('%s_sum%s %.6f' % (self.name, wrapLabels(labels), total))
+            lines.append('%s_count%s %d' % (self.name, wrapLabels(labels), count))
+        return lines
+
+
+class Counter(object):
+    def __init__(self, name, help, labels):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.series = {}
+
+    def inc(self, values, amount=1):
+        self.series[values] = self.series.get(values, 0) + amount
+
+    def render(self):
+        lines = ['# HELP %s %s' % (self.name, self.help), '# TYPE %s counter' % self.name]
+        for values in sorted(self.series):
+            lines.append('%s%s %s' % (self.name, wrapLabels(formatLabels(self.labels, values)), self.series[values]))
+        return lines
+
+
+def escape(value):
+    return unicode(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def formatLabels(names, values):
+    return ','.join('%s="%s"' % (n, escape(v)) for n, v in zip(names, values))
+
+def joinLabels(labels, extra):
+    if labels:
+        return labels + ',' + extra
+    return extra
+
+def wrapLabels(labels):
+    if labels:
+        return '{' + labels + '}'
+    return ''
+
+
+class Registry(object):
+    # process wide, like the metrics of any other prometheus client
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = []
+        self.apiSeconds = self.histogram('trello_api_request_seconds', 'Trello API calls by endpoint.', ('method', 'endpoint'))
+        self.apiErrors = self.counter('trello_api_errors_total', 'Failed Trello API calls by endpoint and status or error.', ('method', 'endpoint', 'error'))
+        self.sqlSeconds = self.histogram('trello_sql_seconds', 'SQL statements issued by the plugin.', ('statement', 'table'))
+        self.sqlErrors = self.counter('trello_sql_errors_total', 'Failed SQL statements issued by the plugin.', ('statement', 'table'))
+        self.convertSeconds = self.histogram('trello_convert_seconds', 'Markdown to wiki conversions (cache misses).', ())
+        self.convertBytes = self.counter('trello_convert_bytes_total', 'Markdown converted to wiki.', ())
+        self.controllerSeconds = self.histogram('trello_controller_seconds', 'Plugin request handlers.', ('controller',))
+        self.controllerErrors = self.counter('trello_controller_errors_total', 'Plugin request handlers that raised.', ('controller',))
+
+    def histogram(self, name, help, labels):
+        metric = Histogram(name, help, labels)
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labels):
+        metric = Counter(name, help, labels)
+        self.metrics.append(metric)
+        return metric
+
+    def observe(self, histogram, values, seconds):
+        self.lock.acquire()
+        try:
+            histogram.observe(values, seconds)
+        finally:
+            self.lock.release()
+
+    def inc(self, counter, values, amount=1):
+        self.lock.acquire()
+        try:
+            counter.inc(values, amount)
+        finally:
+            self.lock.release()
+
+    # gauges = [(name, help, value)] sampled by the caller at scrape time
+    def render(self, gauges=()):
+        lines = []
+        self.lock.acquire()
+        try:
+            for metric in self.metrics:
+                lines.extend(metric.render())
+        finally:
+            self.lock.release()
+        for name, help, value in gauges:
+            lines.append('# HELP %s %s' % (name, help))
+            lines.append('# TYPE %s gauge' % name)
+            lines.append('%s %s' % (name, value))
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+# /cards/4eea4ffc91e31d174600004a/actions -> /cards/{id}/actions
+def endpoint(path):
+    return IDS.sub('/{id}', path.split('?', 1)[0])
+
+def statement(sql):
+    verb = SQL_VERB.match(sql)
+    table = SQL_TABLE.search(sql)
+    return (verb and verb.group(1).upper() or '', table and table.group(1).lower() or '')
+
+
+class TimedCursor(object):
+    # times execute/executemany of a db cursor, everything else is delegated
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    def execute(self, sql, args=None):
+        return self.timed(self.cursor.execute, sql, args)
+
+    def executemany(self, sql, args):
+        return self.timed(self.cursor.executemany, sql, args)
+
+    def timed(self, method, sql, args):
+        labels = statement(sql)
+        start = time.time()
+        try:
+            if args is None:
+                return method(sql)
+            return method(sql, args)
+        except Exception:
+            REGISTRY.inc(REGISTRY.sqlErrors, labels)
+            raise
+        finally:
+            REGISTRY.observe(REGISTRY.sqlSeconds, labels, time.time() - start)
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+
+def cursor(db):
+    return TimedCursor(db.cursor())
@@ -0,0 +1,78 @@
+import time
+
+from trac.core import *
+
+import metrics
+from workqueue import WorkQueue
+
+# Trello rejects longer comments
+MAX_COMMENT = 16384
+
+
+class Outbox(WorkQueue):
+    # comments for Trello cards, sent by the handler of ensureWorker
+    table = 'trello_outbox'
+    workerName = 'trello-outbox'
+    pollOption = 'outbox_poll_interval'
+    claimedStatus = 'sending'
+    createdColumn = 'created'
+    statuses = ('pending', 'sending', 'dead')
+
+    def __init__(self):
+        WorkQueue.__init__(self)
+        self.lastLag = 0
+
+    def add(self, cardId, idTicket, text):
+        now = int(time.time())
+        db = self.env.get_db_cnx()
+        cursor = metrics.cursor(db)
+        cursor.execute("INSERT INTO trello_outbox (card, ticket, text, created, status, attempts, next_attempt) VALUES ((%s),(%s),(%s),(%s),'pending',0,(%s))", [cardId, idTicket, text, now, now])
+        db.commit()
+        self.wakeup.set()
+
+    # let a burst of edits on the same ticket land in one batch
+    def settle(self):
+        time.sleep(self.config.getint('trello', 'outbox_coalesce_delay', 2))
+
+    # send one batch, return the number of entries handled
+    def drain(self):
+        batchSize = self.config.getint('trello', 'outbox_batch_size', 100)
+        maxAttempts = self.config.getint('trello', 'outbox_max_attempts', 8)
+        now = int(time.time())
+
+        db = self.env.get_db_cnx()
+        cursor = metrics.cursor(db)
+        claimed = self.claimRows(cursor, ['card', 'text', 'created', 'attempts'], batchSize, now)
+        db.commit()
+
+        for cardId, entries in self.coalesce(claimed):
+            ids = [e[0] for e in entries]
+            text = '\n\n'.join(e[2] for e in entries)
+            try:
+                self.handler(cardId, text)
+            except Exception, e:
+                attempts = max(entry[4] for entry in entries) + 1
+                self.retry(cursor, ids, attempts, maxAttempts, e, 'Trello comment for card %s' % cardId)
+            else:
+                cursor.executemany("DELETE FROM trello_outbox WHERE id = %s", [(id,) for id in ids])
+                self.lastLag = int(time.time()) - min(entry[3] for entry in entries)
+            db.commit()
+        return len(claimed)
+
+    # group entries per card, in order, without exceeding a comment size
+    def coalesce(self, entries):
+        groups = []
+        current = {}
+        for entry in entries:
+            cardId = entry[1]
+            group = current.get(cardId)
+            if group is None or sum(len(e[2]) + 2 for e in group) + len(entry[2]) > MAX_COMMENT:
+                group = current[cardId] = []
+                groups.append((cardId, group))
+            group.append(entry)
+        return groups
+
+    def getDepth(self):
+        depth = WorkQueue.getDepth(self)
+        depth['lastLag'] = self.lastLag
+        return depth
@@ -0,0 +1,118 @@
+import sys
+import threading
+import Queue
+
+
+class BatchAborted(Exception):
+    # raised by write() when the open batch can't be committed any more
+    # (the database aborted the transaction): never passed to fail(), the
+    # batch is rolled back and the run stops
+    pass
+
+
+class ImportPipeline(object):
+    # prepare() runs on a pool of worker threads, write() runs on the
+    # calling thread in input order and commit() every batchSize writes,
+    # after() goes back to the pool once the batch is committed; with
+    # fail(item, error) an item whose prepare() or write() raises yields
+    # fail's result instead of stopping the run, except BatchAborted
+    def __init__(self, workers, log=None):
+        self.workers = max(1, int(workers))
+        self.log = log
+
+    def run(self, items, prepare, write, after=None, commit=None, rollback=None, batchSize=1, fail=None):
+        tasks = Queue.Queue()
+        results = {}
+        cond = threading.Condition()
+        source = iter(items)
+        submitted = [0]
+
+        def work():
+            while True:
+                task = tasks.get()
+                if task is None:
+                    return
+                kind, index, value = task
+                if kind == 'prepare':
+                    try:
+                        outcome = (True, prepare(value), value)
+                    except Exception:
+                        outcome = (False, sys.exc_info(), value)
+                    cond.acquire()
+                    try:
+                        results[index] = outcome
+                        cond.notify_all()
+                    finally:
+                        cond.release()
+                else:
+                    try:
+                        after(value)
+                    except Exception, e:
+                        if self.log:
+                            self.log.warning('Import pipeline: %s', e)
+
+        def submit():
+            for value in source:
+                tasks.put(('prepare', submitted[0], value))
+                submitted[0] += 1
+                return True
+            return False
+
+        threads = []
+        for i in range(self.workers):
+            t = threading.Thread(target=work)
+            t.setDaemon(True)
+            t.start()
+            threads.append(t)
+
+        # keep only a window of prepared items in memory
+        for i in range(self.workers * 2):
+            if not submit():
+                break
+
+        index = 0
+        batch = []
+        try:
+            try:
+                while index < submitted[0]:
+                    cond.acquire()
+                    try:
+                        while index not in results:
+                            cond.wait()
+                        ok, value, item = results.pop(index)
+                    finally:
+                        cond.release()
+                    index += 1
+                    submit()
+                    if ok:
+                        try:
+                            batch.append((True, write(value)))
+                        except BatchAborted:
+                            raise
+                        except Exception:
+                            if fail is None:
+                                raise
+                            batch.append((False, fail(item, sys.exc_info()[1])))
+                    elif fail is None:
+                        raise value[0], value[1], value[2]
+                    else:
+                        batch.append((False, fail(item, value[1])))
+                    if len(batch) >= batchSize or index == submitted[0]:
+                        if commit is not None:
+                            commit()
+                        for written, result in batch:
+                            if written and after is not None:
+                                tasks.put(('after', index, result))
+                        done, batch = batch, []
+                        for written, result in done:
+                            yield result
+            except:
+                if rollback is not None:
+                    rollback()
+                raise
+        finally:
+            # sentinels are queued behind the pending after() tasks
+            for t in threads:
+                tasks.put(None)
+            for t in threads:
+                t.join()
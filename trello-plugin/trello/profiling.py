@@ -0,0 +1,170 @@
+import json
+import os
+import random
+import re
+import threading
+import time
+
+from trac.core import *
+
+# the capture of the request running on this thread, if any
+current = threading.local()
+
+NAME = re.compile(r'^[\w.-]+\.prof$')
+
+
+def countCards(count=1):
+    capture = getattr(current, 'capture', None)
+    if capture is not None:
+        capture['cards'] += count
+
+
+class TrelloProfiler(Component):
+    # profiles plugin requests picked by [trello] profile_* options or by
+    # an admin adding ?profile=1, only the request thread is profiled;
+    # list import jobs are profiled on the job thread as controller 'job',
+    # always when queued by a profiled request
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.followed = set()
+
+    def getDir(self):
+        return self.config.get('trello', 'profile_dir') or os.path.join(self.env.path, 'log', 'trello-profiles')
+
+    def shouldProfile(self, req, controller):
+        if not self.config.getbool('trello', 'profile_enabled', False):
+            return False
+        if req.args.get('profile') == '1' and 'TRAC_ADMIN' in req.perm:
+            return True
+        controllers = self.config.getlist('trello', 'profile_controllers')
+        if controllers and controller not in controllers:
+            return False
+        boards = self.config.getlist('trello', 'profile_boards')
+        if boards and req.args.get('board') not in boards:
+            return False
+        rate = float(self.config.get('trello', 'profile_sample_rate') or 0)
+        return random.random() < rate
+
+    # a job queued by the request profiled on this thread is profiled too
+    def followJob(self, idJob):
+        if getattr(current, 'capture', None) is not None:
+            self.lock.acquire()
+            try:
+                self.followed.add(idJob)
+            finally:
+                self.lock.release()
+
+    def shouldProfileJob(self, job):
+        if not self.config.getbool('trello', 'profile_enabled', False):
+            return False
+        self.lock.acquire()
+        try:
+            if job['id'] in self.followed:
+                self.followed.discard(job['id'])
+                return True
+        finally:
+            self.lock.release()
+        controllers = self.config.getlist('trello', 'profile_controllers')
+        if controllers and 'job' not in controllers:
+            return False
+        boards = self.config.getlist('trello', 'profile_boards')
+        if boards and job['board'] not in boards:
+            return False
+        rate = float(self.config.get('trello', 'profile_sample_rate') or 0)
+        return random.random() < rate
+
+    def run(self, req, controller, handler):
+        capture = {
+            'controller' : controller,
+            'board' : req.args.get('board'),
+            'list' : req.args.get('thelist'),
+            'card' : req.args.get('card'),
+        }
+        return self.profile(capture, handler, req)
+
+    def runJob(self, job, runner, report):
+        capture = {
+            'controller' : 'job',
+            'board' : job['board'],
+            'list' : job['list'],
+            'card' : None,
+            'job' : job['id'],
+        }
+        return self.profile(capture, runner, job, report)
+
+    def profile(self, capture, func, *args):
+        import cProfile
+        capture['cards'] = 0
+        capture['time'] = int(time.time())
+        current.capture = capture
+        profile = cProfile.Profile()
+        start = time.time()
+        profile.enable()
+        try:
+            return func(*args)
+        finally:
+            profile.disable()
+            current.capture = None
+            capture['seconds'] = round(time.time() - start, 3)
+            try:
+                self.save(profile, capture)
+            except Exception, e:
+                self.log.error('Trello profile not saved: %s', e)
+
+    def save(self, profile, capture):
+        dir = self.getDir()
+        if not os.path.isdir(dir):
+            os.makedirs(dir)
+        name = '%d-%s-%04d.prof' % (capture['time'], capture['controller'], random.randint(0, 9999))
+        path = os.path.join(dir, name)
+        profile.dump_stats(path)
+        f = open(path[:-5] + '.json', 'w')
+        try:
+            json.dump(capture, f)
+        finally:
+            f.close()
+        self.log.info('Trello profile %s saved (%s, %ss)', name, capture['controller'], capture['seconds'])
+        self.prune(dir)
+
+    def prune(self, dir):
+        keep = self.config.getint('trello', 'profile_keep', 50)
+        names = sorted(n for n in os.listdir(dir) if NAME.match(n))
+        for name in names[:max(0, len(names) - keep)]:
+            for path in (os.path.join(dir, name), os.path.join(dir, name[:-5] + '.json')):
+                if os.path.exists(path):
+                    os.remove(path)
+
+    # newest first
+    def listProfiles(self):
+        dir = self.getDir()
+        if not os.path.isdir(dir):
+            return []
+        profiles = []
+        for name in sorted((n for n in os.listdir(dir) if NAME.match(n)), reverse=True):
+            capture = {}
+            path = os.path.join(dir, name[:-5] + '.json')
+            if os.path.exists(path):
+                f = open(path)
+                try:
+                    capture = json.load(f)
+                finally:
+                    f.close()
+            capture['name'] = name
+            profiles.append(capture)
+        return profiles
+
+    # [(calls, tottime, cumtime, function)] by cumulative time
+    def getTopFunctions(self, name, limit=40):
+        import pstats
+        if not NAME.match(name):
+            return None
+        path = os.path.join(self.getDir(), name)
+        if not os.path.exists(path):
+            return None
+        stats = pstats.Stats(path).stats
+        rows = []
+        for (file, line, function), (cc, nc, tt, ct, callers) in stats.items():
+            rows.append((nc, tt, ct, '%s:%d(%s)' % (file, line, function)))
+        rows.sort(key=lambda r: r[2], reverse=True)
+        return rows[:limit]
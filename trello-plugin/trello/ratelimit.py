@@ -0,0 +1,134 @@
+import random
+import threading
+import time
+
+INTERACTIVE = 'interactive'
+BACKGROUND = 'background'
+
+# documented Trello limits, requests per 10 seconds
+TOKEN_LIMIT = 100
+KEY_LIMIT = 300
+LIMIT_WINDOW = 10.0
+
+
+class RateLimited(Exception):
+    pass
+
+
+class TokenBucket(object):
+    def __init__(self, capacity, period):
+        self.capacity = float(capacity)
+        self.fillRate = self.capacity / period
+        self.tokens = self.capacity
+        self.updated = time.time()
+
+    def refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.fillRate)
+        self.updated = now
+
+    # seconds until the bucket holds at least level tokens
+    def delay(self, level):
+        if self.tokens >= level:
+            return 0
+        return (level - self.tokens) / self.fillRate
+
+
+class RequestScheduler(object):
+    # every Trello call takes a token from both the per-token and the
+    # per-key bucket; background calls leave a reserve to interactive
+    # ones and wait while interactive calls are queued
+    def __init__(self, tokenLimit=TOKEN_LIMIT, keyLimit=KEY_LIMIT, reserve=0.2, maxRetries=4):
+        self.buckets = [TokenBucket(tokenLimit, LIMIT_WINDOW), TokenBucket(keyLimit, LIMIT_WINDOW)]
+        self.reserve = reserve
+        self.maxRetries = maxRetries
+        self.cond = threading.Condition()
+        self.blockedUntil = 0
+        self.waiting = {INTERACTIVE : 0, BACKGROUND : 0}
+        self.counters = {'requests' : 0, 'throttled' : 0, 'retries' : 0, 'waitSeconds' : 0.0}
+
+    def acquire(self, priority=INTERACTIVE):
+        start = time.time()
+        self.cond.acquire()
+        try:
+            self.waiting[priority] += 1
+            try:
+                while True:
+                    now = time.time()
+                    for b in self.buckets:
+                        b.refill(now)
+                    if priority == INTERACTIVE:
+                        levels = [1 for b in self.buckets]
+                        yielding = False
+                    else:
+                        levels = [1 + b.capacity * self.reserve for b in self.buckets]
+                        yielding = self.waiting[INTERACTIVE] > 0
+                    delay = max([self.blockedUntil - now] + [b.delay(l) for b, l in zip(self.buckets, levels)])
+                    if delay <= 0 and not yielding:
+                        for b in self.buckets:
+                            b.tokens -= 1
+                        self.counters['requests'] += 1
+                        self.counters['waitSeconds'] += now - start
+                        return
+                    self.cond.wait(max(delay, 0.05))
+            finally:
+                self.waiting[priority] -= 1
+                self.cond.notify_all()
+        finally:
+            self.cond.release()
+
+    def throttle(self, seconds):
+        self.cond.acquire()
+        try:
+            self.blockedUntil = max(self.blockedUntil, time.time() + seconds)
+            for b in self.buckets:
+                b.tokens = 0
+            self.counters['throttled'] += 1
+            self.cond.notify_all()
+        finally:
+            self.cond.release()
+
+    # send() performs the request and returns a response with status and headers
+    def execute(self, send, priority=INTERACTIVE):
+        for attempt in range(self.maxRetries + 1):
+            self.acquire(priority)
+            response = send()
+            if response.status != 429:
+                return response
+            try:
+                retryAfter = float(response.get('retry-after'))
+            except (TypeError, ValueError):
+                retryAfter = 2 ** attempt
+            self.throttle(retryAfter + random.uniform(0, 1))
+            if attempt < self.maxRetries:
+                self.counters['retries'] += 1
+        raise RateLimited('Trello rate limit still exceeded after %d retries' % self.maxRetries)
+
+    def stats(self):
+        self.cond.acquire()
+        try:
+            now = time.time()
+            stats = dict(self.counters)
+            stats['waitingInteractive'] = self.waiting[INTERACTIVE]
+            stats['waitingBackground'] = self.waiting[BACKGROUND]
+            stats['blockedFor'] = max(0, self.blockedUntil - now)
+            stats['tokens'] = min(b.tokens for b in self.buckets)
+            return stats
+        finally:
+            self.cond.release()
+
+
+# one scheduler per trac environment
+_schedulers = {}
+_schedulersLock = threading.Lock()
+
+def getScheduler(key, tokenLimit=TOKEN_LIMIT, keyLimit=KEY_LIMIT):
+    _schedulersLock.acquire()
+    try:
+        scheduler = _schedulers.get(key)
+        limits = [tokenLimit, keyLimit]
+        if scheduler is None or [b.capacity for b in scheduler.buckets] != limits:
+            scheduler = RequestScheduler(tokenLimit, keyLimit)
+            _schedulers[key] = scheduler
+        return scheduler
+    finally:
+        _schedulersLock.release()
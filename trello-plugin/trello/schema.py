@@ -0,0 +1,158 @@
+from trac.core import *
+from trac.env import IEnvironmentSetupParticipant
+from trac.db import Table, Column, Index, DatabaseManager
+
+SCHEMA_VERSION = 8
+
+# tables added by each schema version
+SCHEMA = {
+    1: [
+        Table('trello_webhook_queue', key='id')[
+            Column('id', auto_increment=True),
+            Column('received', type='int'),
+            Column('payload'),
+            Column('status'),
+            Column('attempts', type='int'),
+            Column('next_attempt', type='int'),
+            Column('error'),
+            Index(['status', 'next_attempt']),
+        ],
+    ],
+    2: [
+        Table('trello_card_map', key='card')[
+            Column('card'),
+            Column('ticket', type='int'),
+            Index(['ticket'], unique=True),
+        ],
+    ],
+    3: [
+        Table('trello_outbox', key='id')[
+            Column('id', auto_increment=True),
+            Column('card'),
+            Column('ticket', type='int'),
+            Column('text'),
+            Column('created', type='int'),
+            Column('status'),
+            Column('attempts', type='int'),
+            Column('next_attempt', type='int'),
+            Column('error'),
+            Index(['status', 'next_attempt']),
+        ],
+    ],
+    4: [
+        Table('trello_import_checkpoint', key='list')[
+            Column('list'),
+            Column('card'),
+            Column('done', type='int'),
+            Column('status'),
+            Column('updated', type='int'),
+        ],
+    ],
+    5: [
+        Table('trello_sync_cursor', key='board')[
+            Column('board'),
+            Column('action'),
+            Column('updated', type='int'),
+        ],
+    ],
+    7: [
+        Table('trello_import_job', key='id')[
+            Column('id', auto_increment=True),
+            Column('board'),
+            Column('list'),
+            Column('milestone'),
+            Column('iteration'),
+            Column('author'),
+            Column('status'),
+            Column('total', type='int'),
+            Column('done', type='int'),
+            Column('skipped', type='int'),
+            Column('failed', type='int'),
+            Column('cancel', type='int'),
+            Column('created', type='int'),
+            Column('started', type='int'),
+            Column('updated', type='int'),
+            Column('finished', type='int'),
+            Column('error'),
+            Index(['status']),
+        ],
+    ],
+    8: [
+        Table('trello_import_stage', key='token')[
+            Column('token'),
+            Column('board'),
+            Column('list'),
+            Column('milestone'),
+            Column('iteration'),
+            Column('author'),
+            Column('payload'),
+            Column('selection'),
+            Column('created', type='int'),
+            Column('expires', type='int'),
+            Index(['expires']),
+        ],
+    ],
+}
+
+
+class TrelloSetup(Component):
+
+    implements(IEnvironmentSetupParticipant)
+
+    # IEnvironmentSetupParticipant methods
+    def environment_created(self):
+        db = self.env.get_db_cnx()
+        self.upgrade_environment(db)
+        db.commit()
+
+    def environment_needs_upgrade(self, db):
+        return self.getSchemaVersion(db) < SCHEMA_VERSION
+
+    def upgrade_environment(self, db):
+        version = self.getSchemaVersion(db)
+        connector, _ = DatabaseManager(self.env)._get_connector()
+        cursor = db.cursor()
+        for v in range(version + 1, SCHEMA_VERSION + 1):
+            for table in SCHEMA.get(v, []):
+                for stmt in connector.to_sql(table):
+                    cursor.execute(stmt)
+            upgrade = getattr(self, 'upgradeTo%d' % v, None)
+            if upgrade is not None:
+                upgrade(cursor)
+        if version == 0:
+            cursor.execute("INSERT INTO system (name, value) VALUES ('trello_plugin_version', %s)", [str(SCHEMA_VERSION)])
+        else:
+            cursor.execute("UPDATE system SET value = %s WHERE name = 'trello_plugin_version'", [str(SCHEMA_VERSION)])
+        self.log.info('Upgraded TrelloToTrac schema from version %d to %d', version, SCHEMA_VERSION)
+
+    # fill the card map from the trellocard custom field
+    def upgradeTo2(self, cursor):
+        cursor.execute("SELECT ticket, value FROM ticket_custom WHERE name = 'trellocard' ORDER BY ticket")
+        cards = set()
+        tickets = set()
+        rows = []
+        for ticket, card in cursor.fetchall():
+            if not card or card == '0' or card in cards or ticket in tickets:
+                continue
+            cards.add(card)
+            tickets.add(ticket)
+            rows.append((card, ticket))
+        if rows:
+            cursor.executemany("INSERT INTO trello_card_map (card, ticket) VALUES (%s, %s)", rows)
+        self.log.info('Mapped %d existing Trello cards', len(rows))
+
+    # hash of the card content rendered in the ticket description
+    def upgradeTo6(self, cursor):
+        cursor.execute("ALTER TABLE trello_card_map ADD COLUMN deschash text")
+
+    # import jobs confirmed from a preview read the staged cards
+    def upgradeTo8(self, cursor):
+        cursor.execute("ALTER TABLE trello_import_job ADD COLUMN stage text")
+
+    def getSchemaVersion(self, db):
+        cursor = db.cursor()
+        cursor.execute("SELECT value FROM system WHERE name = 'trello_plugin_version'")
+        row = cursor.fetchone()
+        if row is None:
+            return 0
+        return int(row[0])
@@ -0,0 +1,62 @@
+import binascii
+import json
+import os
+import time
+
+from trac.core import *
+
+import metrics
+
+
+class ImportStaging(Component):
+    # card bundles fetched for a preview, kept in trello_import_stage
+    # until the import is confirmed or the token expires, so the import
+    # writes them without fetching the list again
+
+    def stage(self, boardId, listId, milestone, iteration, author, bundles):
+        now = int(time.time())
+        ttl = self.config.getint('trello', 'stage_ttl', 1800)
+        token = binascii.hexlify(os.urandom(16))
+        payload = json.dumps([b.json for b in bundles])
+        db = self.env.get_db_cnx()
+        cursor = metrics.cursor(db)
+        cursor.execute("DELETE FROM trello_import_stage WHERE expires < %s", [now])
+        cursor.execute("INSERT INTO trello_import_stage (token, board, list, milestone, iteration, author, payload, selection, created, expires) VALUES ((%s),(%s),(%s),(%s),(%s),(%s),(%s),NULL,(%s),(%s))", [token, boardId, listId, milestone, iteration, author, payload, now, now + ttl])
+        db.commit()
+        return token
+
+    # selected card ids, None for all the cards; the import job gets a
+    # full ttl to start
+    def select(self, token, cardIds):
+        ttl = self.config.getint('trello', 'stage_ttl', 1800)
+        db = self.env.get_db_cnx()
+        cursor = metrics.cursor(db)
+        selection = None
+        if cardIds is not None:
+            selection = json.dumps(list(cardIds))
+        cursor.execute("UPDATE trello_import_stage SET selection = %s, expires = %s WHERE token = %s AND expires >= %s", [selection, int(time.time()) + ttl, token, int(time.time())])
+        found = cursor.rowcount == 1
+        db.commit()
+        return found
+
+    def get(self, token):
+        import trelloclient
+        db = self.env.get_db_cnx()
+        cursor = metrics.cursor(db)
+        cursor.execute("SELECT board, list, milestone, iteration, author, payload, selection FROM trello_import_stage WHERE token = %s AND expires >= %s", [token, int(time.time())])
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        boardId, listId, milestone, iteration, author, payload, selection = row
+        bundles = [trelloclient.TrelloCardBundle(c) for c in json.loads(payload)]
+        if selection is not None:
+            selected = set(json.loads(selection))
+            bundles = [b for b in bundles if b.id in selected]
+        return {'board' : boardId, 'list' : listId, 'milestone' : milestone, 'iteration' : iteration,
+                'author' : author, 'bundles' : bundles}
+
+    def discard(self, token):
+        db = self.env.get_db_cnx()
+        cursor = metrics.cursor(db)
+        cursor.execute("DELETE FROM trello_import_stage WHERE token = %s", [token])
+        db.commit()
@@ -0,0 +1,149 @@
+import time
+
+from trac.core import *
+
+from trello import TrelloToTracPlugin
+from timestamps import parseTrelloDate
+import metrics
+
+SYNC_FILTER = 'createCard,copyCard,moveCardToBoard,commentCard,updateCard'
+
+
+class TrelloSync(Component):
+    # applies the board actions newer than the stored cursor
+
+    def syncBoard(self, boardId, listIds, milestone, iteration, trello):
+        import trelloclient
+        plugin = TrelloToTracPlugin(self.env)
+        board = trelloclient.TrelloBoard(trello, boardId)
+        stats = {'cards' : 0, 'comments' : 0, 'renames' : 0, 'descriptions' : 0, 'moves' : 0}
+
+        since = self.getCursor(boardId)
+        if since is None:
+            # first run: start from the latest action, 'trello import' covers the past
+            latest = board.fetchJson(
+                uri_path = board.base_uri+'/actions',
+                query_params = {'limit' : 1, 'fields' : 'id'}
+            )
+            if len(latest):
+                self.saveCursor(boardId, latest[0]['id'])
+            return stats
+
+        actions = board.getActionsSince(since, SYNC_FILTER)
+        if not len(actions):
+            return stats
+
+        # new cards first, their bundle already holds every comment
+        newCards = []
+        for a in actions:
+            card = a['data'].get('card')
+            if card is None or card['id'] in newCards:
+                continue
+            if a['type'] == 'updateCard':
+                if 'listAfter' not in a['data']:
+                    continue
+                listId = a['data']['listAfter']['id']
+            else:
+                listId = a['data'].get('list', {}).get('id')
+            if listId in listIds and not plugin.ticketCardExist(card['id']):
+                newCards.append(card['id'])
+        # labels and members of the board shared with the single card imports
+        context = None
+        if newCards:
+            context = plugin.getBoardContext(boardId, trello, False)
+        bundles = (trelloclient.TrelloCard(trello, cardId).getCardBundle(context) for cardId in newCards)
+        for result in plugin.importCardBundles(bundles, milestone, iteration, trello):
+            if result['res']:
+                stats['cards'] += 1
+
+        descChanged = []
+        for a in actions:
+            card = a['data'].get('card')
+            if card is None or card['id'] in newCards:
+                continue
+            idTicket = plugin.getTicketIdByCardId(card['id'])
+            if idTicket is None:
+                continue
+            if a['type'] == 'commentCard':
+                action = trelloclient.TrelloWebhookAction(trello, a['id'])
+                action.loadJson({'action' : a})
+                if plugin.addCommentByAction(action):
+                    stats['comments'] += 1
+            elif a['type'] == 'updateCard':
+                old = a['data'].get('old', {})
+                if 'name' in old and self.renameTicket(plugin, idTicket, card['name'], a):
+                    stats['renames'] += 1
+                if 'desc' in old and card['id'] not in descChanged:
+                    descChanged.append(card['id'])
+                if 'listAfter' in a['data'] and self.addMoveComment(plugin, idTicket, a):
+                    stats['moves'] += 1
+
+        db = self.env.get_db_cnx()
+        cursor = metrics.cursor(db)
+        if descChanged and context is None:
+            context = plugin.getBoardContext(boardId, trello, False)
+        for cardId in descChanged:
+            bundle = trelloclient.TrelloCard(trello, cardId).getCardBundle(context)
+            # unchanged content, skip rendering and the update
+            if plugin.getCardHash(bundle) == plugin.getCardHashByCardId(cardId):
+                continue
+            cardContent = plugin.renderCardBundle(bundle)
+            cursor.execute("UPDATE ticket SET description = %s WHERE id = %s", [cardContent['desc'], plugin.getTicketIdByCardId(cardId)])
+            cursor.execute("UPDATE trello_card_map SET deschash = %s WHERE card = %s", [cardContent['hash'], cardId])
+            stats['descriptions'] += 1
+        self.saveCursor(boardId, actions[-1]['id'], cursor)
+        db.commit()
+        return stats
+
+    # False when the summary is already the new name
+    def renameTicket(self, plugin, idTicket, name, action):
+        if self.config.getbool('trello', 'estimationtools'):
+            name = plugin.getSizeByName(name)['name']
+        timestamp = parseTrelloDate(action['date'])
+        author = self.getAuthor(plugin, action)
+        db = self.env.get_db_cnx()
+        cursor = metrics.cursor(db)
+        cursor.execute("SELECT summary FROM ticket WHERE id = %s", [idTicket])
+        oldName = cursor.fetchone()[0]
+        if oldName == name:
+            return False
+        cursor.execute("UPDATE ticket SET summary = %s, changetime = %s WHERE id = %s", [name, timestamp, idTicket])
+        cursor.execute("INSERT INTO ticket_change VALUES ((%s),(%s),(%s),(%s),(%s),(%s))", [idTicket, timestamp, author, 'summary', oldName, name])
+        return True
+
+    # False when a rerun from an older cursor already added it
+    def addMoveComment(self, plugin, idTicket, action):
+        text = "[trello] Card moved from ''%s'' to ''%s''" % (action['data']['listBefore']['name'], action['data']['listAfter']['name'])
+        timestamp = parseTrelloDate(action['date'])
+        db = self.env.get_db_cnx()
+        cursor = metrics.cursor(db)
+        cursor.execute("SELECT 1 FROM ticket_change WHERE ticket = %s AND time = %s AND field = 'comment' AND newvalue = %s", [idTicket, timestamp, text])
+        if cursor.fetchone() is not None:
+            return False
+        cursor.execute("INSERT INTO ticket_change VALUES ((%s),(%s),(%s),(%s),(%s),(%s))", [idTicket, timestamp, self.getAuthor(plugin, action), 'comment', '', text])
+        return True
+
+    def getAuthor(self, plugin, action):
+        author = plugin.getUserByTrelloId(action['idMemberCreator'], action['data'].get('board', {}).get('id'))
+        if author is None:
+            author = 'trello'
+        return author
+
+    def getCursor(self, boardId):
+        db = self.env.get_db_cnx()
+        cursor = metrics.cursor(db)
+        cursor.execute("SELECT action FROM trello_sync_cursor WHERE board = %s", [boardId])
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        return row[0]
+
+    def saveCursor(self, boardId, actionId, cursor=None):
+        db = None
+        if cursor is None:
+            db = self.env.get_db_cnx()
+            cursor = metrics.cursor(db)
+        cursor.execute("DELETE FROM trello_sync_cursor WHERE board = %s", [boardId])
+        cursor.execute("INSERT INTO trello_sync_cursor (board, action, updated) VALUES ((%s),(%s),(%s))", [boardId, actionId, int(time.time())])
+        if db is not None:
+            db.commit()
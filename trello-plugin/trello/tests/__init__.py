@@ -0,0 +1,16 @@
+import unittest
+
+from trello.tests import export, markdowntowiki, pipeline, timestamps, writer
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(export.suite())
+    suite.addTest(markdowntowiki.suite())
+    suite.addTest(pipeline.suite())
+    suite.addTest(timestamps.suite())
+    suite.addTest(writer.suite())
+    return suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
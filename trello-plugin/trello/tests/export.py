@@ -0,0 +1,46 @@
+import unittest
+from StringIO import StringIO
+
+from trello.export import iterExport, ExportError
+
+EXPORT = '{"id": "b1", "name": "Board", "closed": false, "lists": [{"id": "l1", "pos": 16384}, {"id": "l2", "pos": 32768.5}], "cards": [], "labels": [{"id": "g1", "name": null}]}'
+
+
+class IterExportTestCase(unittest.TestCase):
+
+    def export(self, data, chunkSize):
+        return list(iterExport(StringIO(data), chunkSize))
+
+    def test_members_and_array_elements(self):
+        self.assertEqual([(u'id', u'b1'), (u'name', u'Board'), (u'closed', False),
+                          (u'lists', {u'id': u'l1', u'pos': 16384}), (u'lists', {u'id': u'l2', u'pos': 32768.5}),
+                          (u'labels', {u'id': u'g1', u'name': None})], self.export(EXPORT, 65536))
+
+    def test_values_split_across_chunks(self):
+        expected = self.export(EXPORT, 65536)
+        for chunkSize in (1, 2, 3, 7, 16):
+            self.assertEqual(expected, self.export(EXPORT, chunkSize))
+
+    def test_number_at_chunk_edge(self):
+        # 12345 must not come out as 12 when the chunk ends after the 2
+        self.assertEqual([(u'pos', 12345)], self.export('{"pos":12345}', 9))
+
+    def test_multibyte_utf8_at_chunk_edge(self):
+        data = '{"name": "\xc3\xa9t\xc3\xa9 \xe2\x82\xac", "cards": [{"name": "\xf0\x9f\x98\x80"}]}'
+        expected = [(u'name', u'\xe9t\xe9 \u20ac'), (u'cards', {u'name': u'\U0001f600'})]
+        for chunkSize in range(1, len(data) + 1):
+            self.assertEqual(expected, self.export(data, chunkSize))
+
+    def test_empty_export(self):
+        self.assertEqual([], self.export(' { } ', 1))
+
+    def test_truncated_export(self):
+        self.assertRaises(ExportError, self.export, EXPORT[:-20], 7)
+        self.assertRaises(ExportError, self.export, '{"name": "Boa', 7)
+
+
+def suite():
+    return unittest.makeSuite(IterExportTestCase)
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
@@ -0,0 +1,41 @@
+import unittest
+
+from trello.markdowntowiki import convert
+
+
+class ConvertTestCase(unittest.TestCase):
+
+    def test_image(self):
+        self.assertEqual('[[Image(https://trello.com/a/image.png)]]',
+                         convert('![image.png](https://trello.com/a/image.png)'))
+        self.assertEqual('see [[Image(http://x/y.png)]] !', convert('see ![](http://x/y.png "title") !'))
+
+    def test_link(self):
+        self.assertEqual("[http://x.org the '''site''']", convert('[the **site**](http://x.org)'))
+
+    def test_emphasis(self):
+        self.assertEqual("'''bold''' ''em'' ''em'' ~~gone~~", convert('**bold** _em_ *em* ~~gone~~'))
+        self.assertEqual('snake_case_name 2*3*4', convert('snake_case_name 2*3*4'))
+
+    def test_code(self):
+        self.assertEqual('{{{a*b*c}}}', convert('`a*b*c`'))
+        self.assertEqual('{{{\n*raw* _text_\n}}}', convert('```\n*raw* _text_\n```'))
+        self.assertEqual('{{{\nopen\n}}}', convert('```\nopen'))
+
+    def test_blocks(self):
+        self.assertEqual("= Title '''b''' =", convert('# Title **b**'))
+        self.assertEqual('=== Third ===', convert('### Third ###'))
+        self.assertEqual(' * a\n   * b\n 1. one', convert('- a\n  - b\n1. one'))
+        self.assertEqual('  quoted', convert('> quoted'))
+        self.assertEqual('----', convert('---'))
+
+    def test_paragraphs(self):
+        self.assertEqual('l1 [[br]]\nl2\n\nl3', convert('l1\nl2\n\nl3'))
+        self.assertEqual('l1 [[br]]\nl2', convert('l1\r\nl2'))
+
+
+def suite():
+    return unittest.makeSuite(ConvertTestCase)
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
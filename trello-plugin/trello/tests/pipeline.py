@@ -0,0 +1,91 @@
+import unittest
+
+from trello.pipeline import ImportPipeline, BatchAborted
+
+
+class ImportPipelineTestCase(unittest.TestCase):
+
+    def run_pipeline(self, items, prepare, write, batchSize, fail=None):
+        calls = []
+
+        def commit():
+            calls.append('commit')
+
+        def rollback():
+            calls.append('rollback')
+
+        def written(value):
+            result = write(value)
+            calls.append(('write', result))
+            return result
+
+        pipeline = ImportPipeline(3)
+        results = list(pipeline.run(items, prepare, written, None, commit, rollback, batchSize, fail))
+        return results, calls
+
+    def test_bad_card_in_batch(self):
+        def prepare(item):
+            if item == 7:
+                raise ValueError('bad card %d' % item)
+            return item
+
+        def fail(item, error):
+            return ('failed', item, str(error))
+
+        results, calls = self.run_pipeline(range(1, 11), prepare, lambda v: v, 5, fail)
+        self.assertEqual([1, 2, 3, 4, 5, 6, ('failed', 7, 'bad card 7'), 8, 9, 10], results)
+        self.assertEqual(2, calls.count('commit'))
+        self.assertFalse('rollback' in calls)
+
+    def test_bad_write_in_batch(self):
+        def write(value):
+            if value == 3:
+                raise ValueError('bad write')
+            return value
+
+        results, calls = self.run_pipeline(range(1, 6), lambda v: v, write, 5, lambda i, e: ('failed', i))
+        self.assertEqual([1, 2, ('failed', 3), 4, 5], results)
+        self.assertEqual(['commit'], [c for c in calls if c == 'commit'])
+
+    def test_aborted_batch_rolls_back(self):
+        def write(value):
+            if value == 3:
+                raise BatchAborted('transaction aborted')
+            return value
+
+        failed = []
+        results = []
+        pipeline = ImportPipeline(2)
+        calls = []
+        run = pipeline.run(range(1, 6), lambda v: v, write, None, lambda: calls.append('commit'),
+                           lambda: calls.append('rollback'), 5, lambda i, e: failed.append(i))
+        try:
+            for result in run:
+                results.append(result)
+        except BatchAborted:
+            pass
+        else:
+            self.fail('BatchAborted not raised')
+        # nothing of the batch is reported as written
+        self.assertEqual([], results)
+        self.assertEqual([], failed)
+        self.assertEqual(['rollback'], calls)
+
+    def test_error_without_fail_rolls_back(self):
+        def prepare(item):
+            if item == 3:
+                raise ValueError('bad card')
+            return item
+
+        pipeline = ImportPipeline(2)
+        calls = []
+        results = pipeline.run(range(1, 6), prepare, lambda v: v, None, None, lambda: calls.append('rollback'), 5)
+        self.assertRaises(ValueError, list, results)
+        self.assertEqual(['rollback'], calls)
+
+
+def suite():
+    return unittest.makeSuite(ImportPipelineTestCase)
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
@@ -0,0 +1,25 @@
+import unittest
+
+from trello.timestamps import parseTrelloDate, getObjectIdTime
+
+
+class TimestampsTestCase(unittest.TestCase):
+
+    def test_date_with_milliseconds(self):
+        self.assertEqual(1395397264, parseTrelloDate('2014-03-21T10:21:04.123Z'))
+
+    def test_date_without_milliseconds(self):
+        self.assertEqual(1395397264, parseTrelloDate('2014-03-21T10:21:04Z'))
+
+    def test_epoch(self):
+        self.assertEqual(0, parseTrelloDate('1970-01-01T00:00:00.000Z'))
+
+    def test_object_id_time(self):
+        self.assertEqual(1395397264, getObjectIdTime('532c1290a1b2c3d4e5f60718'))
+
+
+def suite():
+    return unittest.makeSuite(TimestampsTestCase)
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
@@ -0,0 +1,91 @@
+import unittest
+
+from trello.pipeline import BatchAborted
+from trello.writer import TicketWriter, TICKET_COLUMNS
+
+
+class FakeCursor(object):
+    def __init__(self, db):
+        self.db = db
+
+    def execute(self, sql, args=None):
+        self.db.run(sql)
+
+    def executemany(self, sql, args):
+        self.db.run(sql)
+
+
+class FakeDb(object):
+    # fails the statements starting with one of failing; once aborted
+    # (like PostgreSQL after an error) every statement fails
+    def __init__(self, failing=(), aborts=False):
+        self.failing = failing
+        self.aborts = aborts
+        self.aborted = False
+        self.statements = []
+        self.lastId = 0
+
+    def run(self, sql):
+        if self.aborted:
+            raise Exception('current transaction is aborted')
+        for prefix in self.failing:
+            if sql.startswith(prefix):
+                self.aborted = self.aborts
+                raise Exception('%s failed' % prefix)
+        self.statements.append(sql.split(' (')[0])
+        if sql.startswith('INSERT INTO ticket '):
+            self.lastId += 1
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def get_last_id(self, cursor, table):
+        return self.lastId
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+
+def record():
+    return {
+        'ticket' : dict((c, '') for c in TICKET_COLUMNS),
+        'card' : 'card',
+        'custom' : [('trellocard', 'card')],
+        'changes' : [(0, 'trello', 'comment', '', 'text')],
+    }
+
+
+class TicketWriterTestCase(unittest.TestCase):
+
+    def test_write(self):
+        db = FakeDb()
+        writer = TicketWriter(db)
+        self.assertEqual(1, writer.write(record()))
+        self.assertEqual(1, writer.pending)
+
+    def test_failed_record_is_discarded(self):
+        db = FakeDb(failing=['INSERT INTO ticket_change'])
+        writer = TicketWriter(db)
+        self.assertRaises(Exception, writer.write, record())
+        self.assertTrue('DELETE FROM ticket WHERE id = %s' in db.statements)
+        self.assertEqual(0, writer.pending)
+
+    def test_discard_fails_aborts_batch(self):
+        db = FakeDb(failing=['INSERT INTO ticket_change'], aborts=True)
+        writer = TicketWriter(db)
+        self.assertRaises(BatchAborted, writer.write, record())
+
+    def test_ticket_insert_fails_aborts_batch(self):
+        db = FakeDb(failing=['INSERT INTO ticket '], aborts=True)
+        writer = TicketWriter(db)
+        self.assertRaises(BatchAborted, writer.write, record())
+
+
+def suite():
+    return unittest.makeSuite(TicketWriterTestCase)
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
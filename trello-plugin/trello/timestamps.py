@@ -0,0 +1,23 @@
+import calendar
+import re
+
+# Trello always sends dates as 2014-03-21T10:21:04.123Z
+TRELLO_DATE = re.compile(r'^(\d{4})-(\d\d)-(\d\d)T(\d\d):(\d\d):(\d\d)(?:\.\d+)?Z$')
+
+
+# seconds since the epoch of a Trello date
+def parseTrelloDate(date):
+    m = TRELLO_DATE.match(date)
+    if m:
+        return calendar.timegm([int(g) for g in m.groups()])
+    # anything else goes through dateutil
+    from dateutil import parser
+    dt = parser.parse(date)
+    if dt.tzinfo is not None:
+        return calendar.timegm(dt.utctimetuple())
+    return calendar.timegm(dt.timetuple())
+
+
+# Trello ids are Mongo ObjectIds, the first 4 bytes are the creation time
+def getObjectIdTime(objectId):
+    return int(objectId[:8], 16)
@@ -0,0 +1,175 @@
+import httplib
+import socket
+import threading
+import urlparse
+
+# requests sent again on a new connection when a reused one fails after
+# sending, resending a POST could duplicate a comment on Trello
+RETRY_METHODS = ('GET', 'HEAD')
+
+
+class TransportError(Exception):
+    pass
+
+
+class SendError(Exception):
+    # the request could not be written, the server didn't get it
+    def __init__(self, error):
+        Exception.__init__(self, error)
+        self.error = error
+
+
+class HttpResponse(object):
+    def __init__(self, status, reason, headers, content):
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self.content = content
+
+    def __getitem__(self, name):
+        return self.headers[name.lower()]
+
+    def get(self, name, default=None):
+        return self.headers.get(name.lower(), default)
+
+
+class HttpTransport(object):
+    # keep-alive connections pooled per (scheme, host), at most
+    # maxPerHost of them open at the same time for a host
+    def __init__(self, maxPerHost=4, timeout=30):
+        self.maxPerHost = max(1, int(maxPerHost))
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.idle = {}
+        self.slots = {}
+        self.counters = {
+            'requests' : 0,
+            'opened' : 0,
+            'reused' : 0,
+            'errors' : 0,
+        }
+
+    def request(self, method, url, body=None, headers={}):
+        parts = urlparse.urlsplit(url)
+        key = (parts.scheme, parts.netloc)
+        path = parts.path
+        if parts.query:
+            path += '?' + parts.query
+
+        slot = self.getSlot(key)
+        slot.acquire()
+        try:
+            conn, reused = self.getConnection(key)
+            try:
+                response = self.send(conn, method, path, body, headers)
+            except (SendError, httplib.HTTPException, socket.error), e:
+                conn.close()
+                if not reused or not (isinstance(e, SendError) or method in RETRY_METHODS):
+                    self.count('errors')
+                    raise TransportError('%s %s: %s' % (method, parts.netloc, getattr(e, 'error', e)))
+                # the server dropped an idle keep-alive connection, retry on a new one
+                conn, reused = self.newConnection(key), False
+                try:
+                    response = self.send(conn, method, path, body, headers)
+                except (SendError, httplib.HTTPException, socket.error), e:
+                    conn.close()
+                    self.count('errors')
+                    raise TransportError('%s %s: %s' % (method, parts.netloc, getattr(e, 'error', e)))
+            if response.get('connection', '').lower() == 'close':
+                conn.close()
+            else:
+                self.releaseConnection(key, conn)
+            return response
+        finally:
+            slot.release()
+
+    def send(self, conn, method, path, body, headers):
+        try:
+            conn.request(method, path, body, headers)
+        except (httplib.HTTPException, socket.error), e:
+            raise SendError(e)
+        r = conn.getresponse()
+        content = r.read()
+        self.count('requests')
+        responseHeaders = dict((k.lower(), v) for k, v in r.getheaders())
+        return HttpResponse(r.status, r.reason, responseHeaders, content)
+
+    def getSlot(self, key):
+        self.lock.acquire()
+        try:
+            if key not in self.slots:
+                self.slots[key] = threading.BoundedSemaphore(self.maxPerHost)
+            return self.slots[key]
+        finally:
+            self.lock.release()
+
+    def getConnection(self, key):
+        self.lock.acquire()
+        try:
+            idle = self.idle.get(key)
+            if idle:
+                self.counters['reused'] += 1
+                return idle.pop(), True
+        finally:
+            self.lock.release()
+        return self.newConnection(key), False
+
+    def newConnection(self, key):
+        scheme, netloc = key
+        if scheme == 'https':
+            conn = httplib.HTTPSConnection(netloc, timeout=self.timeout)
+        else:
+            conn = httplib.HTTPConnection(netloc, timeout=self.timeout)
+        self.count('opened')
+        return conn
+
+    def releaseConnection(self, key, conn):
+        self.lock.acquire()
+        try:
+            self.idle.setdefault(key, []).append(conn)
+        finally:
+            self.lock.release()
+
+    def count(self, name):
+        self.lock.acquire()
+        try:
+            self.counters[name] += 1
+        finally:
+            self.lock.release()
+
+    def stats(self):
+        self.lock.acquire()
+        try:
+            stats = dict(self.counters)
+            stats['idle'] = sum(len(c) for c in self.idle.values())
+            return stats
+        finally:
+            self.lock.release()
+
+    def close(self):
+        self.lock.acquire()
+        try:
+            for conns in self.idle.values():
+                for conn in conns:
+                    conn.close()
+            self.idle = {}
+        finally:
+            self.lock.release()
+
+
+# one transport per trac environment
+_transports = {}
+_transportsLock = threading.Lock()
+
+def getTransport(key, maxPerHost=4, timeout=30):
+    _transportsLock.acquire()
+    try:
+        transport = _transports.get(key)
+        if transport is None or transport.maxPerHost != maxPerHost or transport.timeout != timeout:
+            if transport is not None:
+                transport.close()
+            transport = HttpTransport(maxPerHost, timeout)
+            _transports[key] = transport
+        return transport
+    finally:
+        _transportsLock.release()
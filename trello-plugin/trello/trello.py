@@ -5,21 +5,28 @@
 import re
 from genshi.builder import tag
 from trac.core import *
-from trac.web import IRequestHandler
+from trac.web import IRequestHandler, RequestDone
 from trac.web.chrome import INavigationContributor, ITemplateProvider, add_warning, add_notice, add_stylesheet
 from trac.ticket.api import ITicketChangeListener
 
 import time
 from datetime import date, datetime, timedelta
-from dateutil import parser
 from trac.util.datefmt import parse_date, utc, to_timestamp, to_datetime, \
                               get_date_format_hint, get_datetime_format_hint, \
                               format_date, format_datetime
 
-import trelloclient
-import markdowntowiki
-import xmlrpc
 import json
+import hashlib
+from cache import TtlCache, LruCache
+from timestamps import parseTrelloDate, getObjectIdTime
+from webhookqueue import WebhookQueue
+from outbox import Outbox
+from members import MemberDirectory
+from jobs import ImportJobs, FINISHED
+from staging import ImportStaging
+import metrics
+import profiling
+from profiling import TrelloProfiler
 
 class TrelloToTracPlugin(Component):
 
@@ -52,13 +59,19 @@ class TrelloToTracPlugin(Component):
         if 'TRAC_ADMIN' in req.perm:
             match = re.match(r'/trello(?:/(.+))?$', req.path_info)
             if match:
-                if match.group(1):
+                job = re.match(r'jobs/(\d+)(?:/(cancel))?$', match.group(1) or '')
+                if job:
+                    req.args['controller'] = 'jobs'
+                    req.args['job'] = job.group(1)
+                    req.args['action'] = job.group(2)
+                elif match.group(1):
                     req.args['controller'] = match.group(1)
                 return True
         else:
             match1 = re.match(r'/trello/webhook', req.path_info)
             match2 = re.match(r'/trello/sendtotrac', req.path_info)
             match3 = re.match(r'/trello/activemilestones', req.path_info)
+            match4 = re.match(r'/trello/metrics$', req.path_info)
             if match1:
                 req.args['controller'] = 'webhook'
                 return True
@@ -68,10 +81,32 @@ class TrelloToTracPlugin(Component):
             elif match3:
                 req.args['controller'] = 'activemilestones'
                 return True
+            elif match4 and self.config.getbool('trello', 'metrics_public', False):
+                req.args['controller'] = 'metrics'
+                return True
 
     def process_request(self, req):
-        controller = self.controller(req.args.get('controller'))
-        response = controller(req)
+        # picks up webhooks and comments left in the queues by a previous process
+        WebhookQueue(self.env).ensureWorker(self.processWebhookPayload)
+        Outbox(self.env).ensureWorker(self.sendCommentToCard)
+        ImportJobs(self.env).ensureWorker(self.runImportJob)
+        name = req.args.get('controller')
+        controller = self.controller(name)
+        labels = (name or 'index',)
+        profiler = TrelloProfiler(self.env)
+        start = time.time()
+        try:
+            if profiler.shouldProfile(req, labels[0]):
+                response = profiler.run(req, labels[0], controller)
+            else:
+                response = controller(req)
+        except RequestDone:
+            raise
+        except Exception:
+            metrics.REGISTRY.inc(metrics.REGISTRY.controllerErrors, labels)
+            raise
+        finally:
+            metrics.REGISTRY.observe(metrics.REGISTRY.controllerSeconds, labels, time.time() - start)
         return response
 
     # ITemplateProvider methods
@@ -84,11 +119,50 @@ class TrelloToTracPlugin(Component):
         from pkg_resources import resource_filename
         return [('trello', resource_filename(__name__, 'htdocs'))]
 
-    def getUserByTrelloId(self, id):
-        user = self.config.get('trello-user', id)
-        if len(user) == 0:
-            user = None
-        return user
+    # background clients yield to interactive ones in the rate limiter
+    def getTrelloClient(self, background=False):
+        import trelloclient
+        from transport import getTransport
+        import ratelimit
+        apiKey = self.config.get('trello', 'api_key')
+        userAuthToken = self.config.get('trello', 'user_auth_token')
+        maxConnections = self.config.getint('trello', 'http_max_connections', 4)
+        timeout = self.config.getint('trello', 'http_timeout', 30)
+        transport = getTransport(self.env.path, maxConnections, timeout)
+        tokenLimit = self.config.getint('trello', 'rate_limit_token', ratelimit.TOKEN_LIMIT)
+        keyLimit = self.config.getint('trello', 'rate_limit_key', ratelimit.KEY_LIMIT)
+        scheduler = ratelimit.getScheduler(self.env.path, tokenLimit, keyLimit)
+        if background:
+            priority = ratelimit.BACKGROUND
+        else:
+            priority = ratelimit.INTERACTIVE
+        apiUrl = self.config.get('trello', 'api_url', trelloclient.API_URL)
+        pageSize = self.config.getint('trello', 'page_size', trelloclient.PAGE_SIZE)
+        return trelloclient.TrelloClient(apiKey, userAuthToken, transport, scheduler, priority, apiUrl, pageSize)
+
+    # labels and members of the board fetched once for the cards of an
+    # import; without checklists the context is kept in the metadata cache
+    # and shared by the following imports. The board checklists only pay
+    # off for several lists of a board ("trello import"), a list import
+    # keeps them nested in its cards. None when the board can't be read
+    # (e.g. a wrong board id from the bookmarklet), the cards are then
+    # fetched with everything nested
+    def getBoardContext(self, boardId, trello, checklists=True):
+        import trelloclient
+        if not boardId:
+            return None
+        onMembers = MemberDirectory(self.env).setBoardMembers
+        try:
+            if checklists:
+                return trelloclient.TrelloBoardContext(trello, boardId, True, onMembers)
+            return self.getMetadataCache().get(('context', boardId), lambda: trelloclient.TrelloBoardContext(trello, boardId, False, onMembers))
+        except Exception, e:
+            self.log.warning('Trello board %s not loaded, cards fetched without board context: %s', boardId, e)
+            return None
+
+    # None for members without a Trac user
+    def getUserByTrelloId(self, id, boardId=None):
+        return MemberDirectory(self.env).getUser(id, boardId, self.getTrelloClient)
 
     # ITicketChangeListener methods
     # Ticket change hook
@@ -97,18 +171,23 @@ class TrelloToTracPlugin(Component):
 
     def ticket_changed(self, ticket, comment, author, old_values):
         if not old_values:
-            #get trello conf
-            apiKey = self.config.get('trello', 'api_key')
-            userAuthToken = self.config.get('trello', 'user_auth_token')
-            trello = trelloclient.TrelloClient(apiKey,userAuthToken)
             cardId = self.getCardIdByTicketId(ticket.id)
             if cardId != None:
-                card = trelloclient.TrelloCard(trello, cardId)
-                card.addComments('[trac] ' + comment)
+                # delivered to trello by the outbox worker
+                outbox = Outbox(self.env)
+                outbox.add(cardId, ticket.id, '[trac] ' + comment)
+                outbox.ensureWorker(self.sendCommentToCard)
 
+    def sendCommentToCard(self, cardId, text):
+        import trelloclient
+        card = trelloclient.TrelloCard(self.getTrelloClient(background=True), cardId)
+        card.addComments(text)
 
     def ticket_deleted(self, ticket):
-        pass
+        db = self.env.get_db_cnx()
+        cursor = metrics.cursor(db)
+        cursor.execute("DELETE FROM trello_card_map WHERE ticket = %s", [ticket.id])
+        db.commit()
 
     def ticket_comment_modified(self, ticket, cdate, author, comment, old_comment):
         pass
@@ -125,21 +204,22 @@ class TrelloToTracPlugin(Component):
             'webhook': self.webhookController,
             'sendtotrac': self.sendToTracController,
             'activemilestones': self.activeMilestonesController,
+            'clearcache': self.clearCacheController,
+            'status': self.statusController,
+            'metrics': self.metricsController,
+            'profiles': self.profilesController,
+            'jobs': self.jobsController,
+            'confirm': self.confirmController,
             None: self.indexController,
             }[x]
 
     def indexController(self, req):
-        #start db
-        db = self.env.get_db_cnx()
-        cursor = db.cursor()
-
         data = {}
         boardId = ''
         listId = ''
+        iteration = None
 
         #get trello conf
-        apiKey = self.config.get('trello', 'api_key')
-        userAuthToken = self.config.get('trello', 'user_auth_token')
         boardList = self.config.getlist('trello', 'boards')
         listList = self.config.getlist('trello', 'lists')
 
@@ -149,10 +229,8 @@ class TrelloToTracPlugin(Component):
         else:
             field_list = TrelloToTracPlugin.__FIELD
 
-        estimationTools = self.config.getbool('trello', 'estimationtools')
-
         #start trello
-        trello = trelloclient.TrelloClient(apiKey,userAuthToken)
+        trello = self.getTrelloClient()
 
         #get board,list,milestone lists
         boards = self.getBoardList(boardList, trello)
@@ -202,116 +280,17 @@ class TrelloToTracPlugin(Component):
             if error_msg:
                 add_warning(req, error_msg)
                 data = req.args
+            elif req.args.get('preview'):
+                return self.previewList(req, boardId, listId, milestone, iteration, trello)
             else:
-                #general ticket data
-                owner = ''
-                version = ''
-                severity = 'normale'
-                status = 'new'
-                resolution = ''
-                priority = 'normale'
-                keywords = ''
-                component = ''
-                task = 'task'
-
-                board = trelloclient.TrelloBoard(trello, boardId)
-                theList = trelloclient.TrelloList(trello, listId)
-                boardInformation = board.getBoardInformation()
-                listInformation = theList.getListInformation()
-
-                cards = theList.getCards()
-                for c in cards:
-                    cardContent = {}
-                    cardInformation = c.getCardInformation()
-
-                    #Content
-                    cardContent['id'] = cardInformation['id']
-                    cardContent['name'] = cardInformation['name']
-                    cardContent['url'] = cardInformation['url']
-
-                    if (self.ticketCardExist(cardContent['id'])):
-                        error_msg = 'Card "%s" already exists'% cardContent['name']
-                    else:
-                        #size and name/title
-                        if estimationTools:
-                            resultSize = self.getSizeByName(cardInformation['name'])
-                            size = resultSize['size']
-                            cardContent['name'] = resultSize['name']
-
-                        cardId = cardInformation['id']
-                        card = trelloclient.TrelloCard(trello, cardId)
-                        createCard = card.getCreateCard()
-
-                        #date
-                        dt = parser.parse(createCard['actions'][0]['date'])
-                        cardContent['timestamp'] = int(time.mktime(dt.timetuple())-time.timezone)
-
-
-                        #add link to card
-                        cardContent['desc'] = '\'\'\'Card Link:\'\'\'[[br]]\n[' + cardContent['url'] + ' vai a Trello] [[br]] \n'
-                        #covert desc markdown to trac wiki
-                        m2w = markdowntowiki.MarkdownToWiki(cardInformation['desc'])
-                        cardContent['desc'] += '[[br]]\'\'\'Description:\'\'\'[[br]]\n'+m2w.convert() + ' [[br]] \n'
-
-                        idMemberCreator = createCard['actions'][0]['idMemberCreator']
-                        reporter = self.getUserByTrelloId(idMemberCreator)
-                        if reporter is None:
-                            reporter = 'trello'
-                        members=card.getMembers()
-
-                        # owner
-                        owner = self.getFirstMember(members)
-
-                        #cc alla assigned member
-                        cc = self.addMembersToCc(members)
-
-                        #checklist
-                        checklists = card.getChecklists()
-                        cardContent['desc'] = self.addChecklistsToDesc(checklists, cardContent['desc'], trello)
-
-                        #import attachments
-                        attachments = card.getAttachments()
-                        cardContent['desc'] = self.addAttachmentsToDesc(attachments, cardContent['desc'])
-
-                        #labels
-                        labels = cardInformation['labels']
-                        cardContent['desc'] = self.addLabelsToDesc(labels, cardContent['desc'])
-
-                        #insert card in ticket
-                        try:
-                            #id, type, time, changetime, component, severity, priority, owner, reporter, cc, version, milestone, status, resolution, summary, description, keywords
-                            cursor.execute("INSERT INTO ticket (id, type, time, changetime, component, severity, priority, owner, reporter, cc, version, milestone, status, resolution, summary, description, keywords) VALUES (DEFAULT, (%s),(%s),(%s),(%s),(%s),(%s),(%s),(%s),(%s),(%s),(%s),(%s),(%s),(%s),(%s),(%s)) RETURNING id;",[ task, cardContent['timestamp'], cardContent['timestamp'], component , severity, priority, owner, reporter, cc, version, milestone, status, resolution, cardContent['name'], cardContent['desc'], keywords ])
-                            idTicket = cursor.fetchone()[0]
-                            #comment
-                            comments = card.getComments()
-                            self.addCommentsToTicket(comments, idTicket)
-
-                            # Attach link to card on trello
-                            card.addLinkAttachment(self.getLinkByTicketId(idTicket))
-                            # add trellocard id on ticket custom fields
-                            self.addTrellocardToTicket(idTicket, cardContent['id'])
-
-                            #add ticket to iteration
-                            if agileTrac:
-                                self.addTicketToIteration(idTicket,iteration)
-
-                            #add size
-                            if estimationTools:
-                                estimationToolsField = self.config.get('estimation-tools', 'estimation_field')
-                                self.addSizeToTicket(size, estimationToolsField, idTicket, cardContent['timestamp'], reporter)
-
-                        except:
-                            db.rollback()
-                            raise
-                        db.commit()
-
-                        notice_msg='Added card "%s" with id: %s' % (cardContent['name'], idTicket);
-                        add_notice(req, notice_msg)
-
-                    if error_msg:
-                        add_warning(req, error_msg)
-                        error_msg = ''
+                # imported by the job worker, the page follows /trello/jobs/<id>
+                jobs = ImportJobs(self.env)
+                idJob = jobs.create(boardId, listId, milestone, iteration, req.authname)
+                TrelloProfiler(self.env).followJob(idJob)
+                jobs.ensureWorker(self.runImportJob)
+                add_notice(req, 'Import of the list queued as job %s.' % idJob)
                 data = req.args
+                data['job'] = idJob
 
         #forever view data
         data['milestone_placeholder'] = 'milestone name'
@@ -320,6 +299,7 @@ class TrelloToTracPlugin(Component):
         data['boards'] = boards
         data['lists'] = lists
         data['milestones'] = milestones
+        data.setdefault('job', req.args.get('job'))
         add_stylesheet(req, 'trello/css/trello.css')
 
         # This tuple is for Genshi (template_name, data, content_type)
@@ -327,17 +307,13 @@ class TrelloToTracPlugin(Component):
         return 'trello.html', data, None
 
     def singleController(self, req):
-        #start db
-        db = self.env.get_db_cnx()
-        cursor = db.cursor()
-
+        import trelloclient
         data = {}
         boardId = ''
         cardId = ''
+        iteration = None
 
         #get trello conf
-        apiKey = self.config.get('trello', 'api_key')
-        userAuthToken = self.config.get('trello', 'user_auth_token')
         boardList = self.config.getlist('trello', 'boards')
 
         agileTrac = self.config.getbool('trello', 'agile_trac')
@@ -346,10 +322,8 @@ class TrelloToTracPlugin(Component):
         else:
             field_list = TrelloToTracPlugin.__FIELD_SINGLE
 
-        estimationTools = self.config.getbool('trello', 'estimationtools')
-
         #start trello
-        trello = trelloclient.TrelloClient(apiKey,userAuthToken)
+        trello = self.getTrelloClient()
 
         #get list of boards
         boards = self.getBoardList(boardList, trello)
@@ -399,103 +373,16 @@ class TrelloToTracPlugin(Component):
                 add_warning(req, error_msg)
                 data = req.args
             else:
-                #general ticket data
-                owner = ''
-                version = ''
-                severity = 'normale'
-                status = 'new'
-                resolution = ''
-                priority = 'normale'
-                keywords = ''
-                component = ''
-                task = 'task'
-
-                #get board and card info
-                board = trelloclient.TrelloBoard(trello, boardId)
+                #get card bundle
                 card = trelloclient.TrelloCard(trello,cardId)
+                bundle = card.getCardBundle(self.getBoardContext(boardId, trello, False))
 
-                cardContent = {}
-                cardInformation = card.getCardInformation()
-
-                #Content
-                cardContent['id'] = cardInformation['id']
-                cardContent['name'] = cardInformation['name']
-                cardContent['url'] = cardInformation['url']
-
-                if (self.ticketCardExist(cardContent['id'])):
-                    error_msg = 'Card "%s" already exists'% cardContent['name']
-                else:
-                    #size and name/title
-                    if estimationTools:
-                        resultSize = self.getSizeByName(cardInformation['name'])
-                        size = resultSize['size']
-                        cardContent['name'] = resultSize['name']
-
-                    createCard = card.getCreateCard()
-
-                    #date
-                    dt = parser.parse(createCard['actions'][0]['date'])
-                    cardContent['timestamp'] = int(time.mktime(dt.timetuple())-time.timezone)
-
-                    #add link to card
-                    cardContent['desc'] = '\'\'\'Card Link:\'\'\'[[br]]\n[' + cardContent['url'] + ' vai a Trello] [[br]] \n'
-                    #covert desc markdown to trac wiki
-                    m2w = markdowntowiki.MarkdownToWiki(cardInformation['desc'])
-                    cardContent['desc'] += '[[br]]\'\'\'Description:\'\'\'[[br]]\n'+m2w.convert() + ' [[br]] \n'
-
-                    idMemberCreator = createCard['actions'][0]['idMemberCreator']
-                    reporter = self.getUserByTrelloId(idMemberCreator)
-                    if reporter is None:
-                        reporter = 'trello'
-                    members=card.getMembers()
-
-                    # owner
-                    owner = self.getFirstMember(members)
-
-                    # cc alla assigned member
-                    cc = self.addMembersToCc(members)
-
-                    # checklist
-                    checklists = card.getChecklists()
-                    cardContent['desc'] = self.addChecklistsToDesc(checklists, cardContent['desc'], trello)
-
-                    # import attachments
-                    attachments = card.getAttachments()
-                    cardContent['desc'] = self.addAttachmentsToDesc(attachments, cardContent['desc'])
-
-                    # labels
-                    labels = cardInformation['labels']
-                    cardContent['desc'] = self.addLabelsToDesc(labels, cardContent['desc'])
-
-                    # insert card in ticket
-                    try:
-                        # id, type, time, changetime, component, severity, priority, owner, reporter, cc, version, milestone, status, resolution, summary, description, keywords
-                        cursor.execute("INSERT INTO ticket (id, type, time, changetime, component, severity, priority, owner, reporter, cc, version, milestone, status, resolution, summary, description, keywords) VALUES (DEFAULT, (%s),(%s),(%s),(%s),(%s),(%s),(%s),(%s),(%s),(%s),(%s),(%s),(%s),(%s),(%s),(%s)) RETURNING id;",[ task, cardContent['timestamp'], cardContent['timestamp'], component , severity, priority, owner, reporter, cc, version, milestone, status, resolution, cardContent['name'], cardContent['desc'], keywords ])
-                        idTicket = cursor.fetchone()[0]
-                        # comment
-                        comments = card.getComments()
-                        self.addCommentsToTicket(comments, idTicket)
-
-                        # Attach link to card on trello
-                        card.addLinkAttachment(self.getLinkByTicketId(idTicket))
-                        # add trellocard id on ticket custom fields
-                        self.addTrellocardToTicket(idTicket, cardContent['id'])
-
-                        # add ticket to iteration
-                        if agileTrac:
-                            self.addTicketToIteration(idTicket,iteration)
-                        # add size
-                        if estimationTools:
-                            estimationToolsField = self.config.get('estimation-tools', 'estimation_field')
-                            self.addSizeToTicket(size, estimationToolsField, idTicket, cardContent['timestamp'], reporter)
-
-                    except:
-                        db.rollback()
-                        raise
-                    db.commit()
-
-                    notice_msg='Added card "%s" with id: %s' % (cardContent['name'], idTicket);
+                result = self.importCardBundle(bundle, milestone, iteration, trello)
+                if result['res']:
+                    notice_msg='Added card "%s" with id: %s' % (result['name'], result['id']);
                     add_notice(req, notice_msg)
+                else:
+                    error_msg = result['msg']
 
 
                 if error_msg:
@@ -518,57 +405,53 @@ class TrelloToTracPlugin(Component):
         return 'single.html', data, None
 
     def webhookController(self, req):
-        methods = {
-                    'commentCard': self.addCommentByAction
-        }
-        db = self.env.get_db_cnx()
-        cursor = db.cursor()
-
         data = {}
 
-        # get trello conf
-        apiKey = self.config.get('trello', 'api_key')
-        userAuthToken = self.config.get('trello', 'user_auth_token')
-
         data = req.args
 
-        # @TODO check ip
+        # @TODO check ip
         remote_addr = req.remote_addr
         # if (remote_addr == 'x.x.x.x')
 
         self.log.debug("Webhook request form ip: %r", remote_addr)
+        queue = WebhookQueue(self.env)
         # request for webhook registration
-	if req.get_header('Content-Length') is None or int(req.get_header('Content-Length')) == 0:
+        if req.get_header('Content-Length') is None or int(req.get_header('Content-Length')) == 0:
             self.log.debug('Content-Length is None or 0')
-	else:
+        else:
             length = int(req.get_header('Content-Length'))
             body = req.read(length)
             self.log.debug('body: %r', body)
-            dataResponse = json.loads(str(body))
-            #start trello
-            trello = trelloclient.TrelloClient(apiKey,userAuthToken)
-            action = trelloclient.TrelloWebhookAction(trello, dataResponse['action']['id'])
-            action.loadJson(dataResponse)
-
-            if action.type in methods:
-                result = methods[action.type](action)
-            else:
-                self.log.debug('Method %s not implemented', action.type)
+            # only store the action, the queue worker applies it
+            queue.enqueue(body)
+        queue.ensureWorker(self.processWebhookPayload)
 
         return 'webhook.html', data, None
 
-    def sendToTracController(self, req):
-        #start db
-        db = self.env.get_db_cnx()
-        cursor = db.cursor()
+    def processWebhookPayload(self, payload):
+        import trelloclient
+        methods = {
+                    'commentCard': self.addCommentByAction
+        }
+        dataResponse = json.loads(payload)
+        #start trello
+        trello = self.getTrelloClient(background=True)
+        action = trelloclient.TrelloWebhookAction(trello, dataResponse['action']['id'])
+        action.loadJson(dataResponse)
 
+        if action.type in methods:
+            result = methods[action.type](action)
+        else:
+            self.log.debug('Method %s not implemented', action.type)
+
+    def sendToTracController(self, req):
+        import trelloclient
         data = {}
         boardId = ''
         cardId = ''
+        iteration = None
 
         #get trello conf
-        apiKey = self.config.get('trello', 'api_key')
-        userAuthToken = self.config.get('trello', 'user_auth_token')
         boardList = self.config.getlist('trello', 'boards')
 
         agileTrac = self.config.getbool('trello', 'agile_trac')
@@ -577,10 +460,8 @@ class TrelloToTracPlugin(Component):
         else:
             field_list = TrelloToTracPlugin.__FIELD_SINGLE
 
-        estimationTools = self.config.getbool('trello', 'estimationtools')
-
         #start trello
-        trello = trelloclient.TrelloClient(apiKey,userAuthToken)
+        trello = self.getTrelloClient()
 
         #get list of boards
         boards = self.getBoardList(boardList, trello)
@@ -619,103 +500,18 @@ class TrelloToTracPlugin(Component):
             if error_msg:
                 response = error_msg
             else:
-                #general ticket data
-                owner = ''
-                version = ''
-                severity = 'normale'
-                status = 'new'
-                resolution = ''
-                priority = 'normale'
-                keywords = ''
-                component = ''
-                task = 'task'
-
-                #get board and card info
-                board = trelloclient.TrelloBoard(trello, boardId)
-                card = trelloclient.TrelloCard(trello,cardId)
 
-                cardContent = {}
-                cardInformation = card.getCardInformation()
 
-                #Content
-                cardContent['id'] = cardInformation['id']
-                cardContent['name'] = cardInformation['name']
-                cardContent['url'] = cardInformation['url']
+                #get card bundle
+                card = trelloclient.TrelloCard(trello,cardId)
+                bundle = card.getCardBundle(self.getBoardContext(boardId, trello, False))
 
-                if (self.ticketCardExist(cardContent['id'])):
-                    error_msg = 'Card "%s" already exists'% cardContent['name']
-                else:
-                    #size and name/title
-                    if estimationTools:
-                        resultSize = self.getSizeByName(cardInformation['name'])
-                        size = resultSize['size']
-                        cardContent['name'] = resultSize['name']
-
-                    createCard = card.getCreateCard()
-
-                    #date
-                    dt = parser.parse(createCard['actions'][0]['date'])
-                    cardContent['timestamp'] = int(time.mktime(dt.timetuple())-time.timezone)
-
-                    #add link to card
-                    cardContent['desc'] = '\'\'\'Card Link:\'\'\'[[br]]\n[' + cardContent['url'] + ' vai a Trello] [[br]] \n'
-                    #covert desc markdown to trac wiki
-                    m2w = markdowntowiki.MarkdownToWiki(cardInformation['desc'])
-                    cardContent['desc'] += '[[br]]\'\'\'Description:\'\'\'[[br]]\n'+m2w.convert() + ' [[br]] \n'
-
-                    idMemberCreator = createCard['actions'][0]['idMemberCreator']
-                    reporter = self.getUserByTrelloId(idMemberCreator)
-                    if reporter is None:
-                        reporter = 'trello'
-                    members=card.getMembers()
-
-                    # owner
-                    owner = self.getFirstMember(members)
-
-                    # cc alla assigned member
-                    cc = self.addMembersToCc(members)
-
-                    # checklist
-                    checklists = card.getChecklists()
-                    cardContent['desc'] = self.addChecklistsToDesc(checklists, cardContent['desc'], trello)
-
-                    # import attachments
-                    attachments = card.getAttachments()
-                    cardContent['desc'] = self.addAttachmentsToDesc(attachments, cardContent['desc'])
-
-                    # labels
-                    labels = cardInformation['labels']
-                    cardContent['desc'] = self.addLabelsToDesc(labels, cardContent['desc'])
-
-                    # insert card in ticket
-                    try:
-                        # id, type, time, changetime, component, severity, priority, owner, reporter, cc, version, milestone, status, resolution, summary, description, keywords
-                        cursor.execute("INSERT INTO ticket (id, type, time, changetime, component, severity, priority, owner, reporter, cc, version, milestone, status, resolution, summary, description, keywords) VALUES (DEFAULT, (%s),(%s),(%s),(%s),(%s),(%s),(%s),(%s),(%s),(%s),(%s),(%s),(%s),(%s),(%s),(%s)) RETURNING id;",[ task, cardContent['timestamp'], cardContent['timestamp'], component , severity, priority, owner, reporter, cc, version, milestone, status, resolution, cardContent['name'], cardContent['desc'], keywords ])
-                        idTicket = cursor.fetchone()[0]
-                        # comment
-                        comments = card.getComments()
-                        self.addCommentsToTicket(comments, idTicket)
-
-                        # Attach link to card on trello
-                        card.addLinkAttachment(self.getLinkByTicketId(idTicket))
-                        # add trellocard id on ticket custom fields
-                        self.addTrellocardToTicket(idTicket, cardContent['id'])
-
-                        # add ticket to iteration
-                        if agileTrac:
-                            self.addTicketToIteration(idTicket,iteration)
-                        # add size
-                        if estimationTools:
-                            estimationToolsField = self.config.get('estimation-tools', 'estimation_field')
-                            self.addSizeToTicket(size, estimationToolsField, idTicket, cardContent['timestamp'], reporter)
-
-                    except:
-                        db.rollback()
-                        raise
-                    db.commit()
-
-                    notice_msg='Added card "%s" with id: %s' % (cardContent['name'], idTicket);
+                result = self.importCardBundle(bundle, milestone, iteration, trello)
+                if result['res']:
+                    notice_msg='Added card "%s" with id: %s' % (result['name'], result['id']);
                     response = notice_msg
+                else:
+                    error_msg = result['msg']
 
                 if error_msg:
                     response = error_msg
@@ -727,6 +523,163 @@ class TrelloToTracPlugin(Component):
         req.write(response)
 
 
+    def clearCacheController(self, req):
+        if req.method == 'POST':
+            self.getMetadataCache().invalidate()
+            MemberDirectory(self.env).invalidate()
+            add_notice(req, 'Trello board and list cache cleared.')
+        req.redirect(req.href.trello())
+
+    def statusController(self, req):
+        trello = self.getTrelloClient()
+        status = {}
+        status['scheduler'] = trello.scheduler.stats()
+        status['transport'] = trello.transport.stats()
+        status['cache'] = self.getMetadataCache().stats()
+        status['convertCache'] = self.getConvertCache().stats()
+        status['webhookQueue'] = WebhookQueue(self.env).getDepth()
+        status['outbox'] = Outbox(self.env).getDepth()
+        response = json.dumps(status)
+
+        req.send_response(200)
+        req.send_header('Content-Type', 'application/json')
+        req.send_header('Content-Length', len(response))
+        req.end_headers()
+        req.write(response)
+
+    def metricsController(self, req):
+        queue = WebhookQueue(self.env).getDepth()
+        outbox = Outbox(self.env).getDepth()
+        gauges = [
+            ('trello_webhook_queue_pending', 'Webhook actions waiting to be applied.', queue['pending']),
+            ('trello_webhook_queue_dead', 'Webhook actions given up after the last attempt.', queue['dead']),
+            ('trello_webhook_queue_lag_seconds', 'Age of the oldest webhook action not applied yet.', queue['lag']),
+            ('trello_outbox_pending', 'Trac comments waiting to be sent to Trello.', outbox['pending']),
+            ('trello_outbox_lag_seconds', 'Age of the oldest Trac comment not sent yet.', outbox['lag']),
+        ]
+        response = metrics.REGISTRY.render(gauges).encode('utf-8')
+
+        req.send_response(200)
+        req.send_header('Content-Type', 'text/plain; version=0.0.4')
+        req.send_header('Content-Length', len(response))
+        req.end_headers()
+        req.write(response)
+
+    def profilesController(self, req):
+        profiler = TrelloProfiler(self.env)
+        data = {}
+        data['enabled'] = self.config.getbool('trello', 'profile_enabled', False)
+        data['profiles'] = profiler.listProfiles()
+        data['selected'] = req.args.get('name')
+        data['functions'] = None
+        if data['selected']:
+            data['functions'] = profiler.getTopFunctions(data['selected'])
+            if data['functions'] is None:
+                add_warning(req, 'Profile "%s" not found.' % data['selected'])
+        add_stylesheet(req, 'trello/css/trello.css')
+        return 'profiles.html', data, None
+
+    # fetch the list once, show the tickets it would create and stage the
+    # cards for confirmController
+    def previewList(self, req, boardId, listId, milestone, iteration, trello):
+        import trelloclient
+        bundles = trelloclient.TrelloList(trello, listId).getCardBundles(self.getBoardContext(boardId, trello, False))
+        token = ImportStaging(self.env).stage(boardId, listId, milestone, iteration, req.authname, bundles)
+        cards = []
+        for bundle in bundles:
+            cardContent = self.renderCardBundle(bundle)
+            cards.append({
+                'id' : bundle.id,
+                'summary' : cardContent['name'],
+                'owner' : cardContent['owner'],
+                'cc' : cardContent['cc'],
+                'size' : cardContent['size'],
+                'imported' : self.ticketCardExist(bundle.id),
+            })
+        data = {}
+        data['token'] = token
+        data['cards'] = cards
+        data['milestone'] = milestone
+        data['iteration'] = iteration
+        data['estimationtools'] = self.config.getbool('trello', 'estimationtools')
+        data['expires'] = self.config.getint('trello', 'stage_ttl', 1800) // 60
+        add_stylesheet(req, 'trello/css/trello.css')
+        return 'preview.html', data, None
+
+    # import the staged cards of a preview, all or the checked ones
+    def confirmController(self, req):
+        if req.method != 'POST':
+            req.redirect(req.href.trello())
+        token = req.args.get('token')
+        staging = ImportStaging(self.env)
+        stage = staging.get(token)
+        if stage is None or stage['author'] != req.authname:
+            add_warning(req, 'The preview has expired, preview the list again.')
+            req.redirect(req.href.trello())
+        cardIds = None
+        if not req.args.get('all'):
+            cardIds = req.args.get('card') or []
+            if not isinstance(cardIds, list):
+                cardIds = [cardIds]
+            if not cardIds:
+                add_warning(req, 'No card selected.')
+                req.redirect(req.href.trello())
+        staging.select(token, cardIds)
+        jobs = ImportJobs(self.env)
+        idJob = jobs.create(stage['board'], stage['list'], stage['milestone'], stage['iteration'], req.authname, token)
+        TrelloProfiler(self.env).followJob(idJob)
+        jobs.ensureWorker(self.runImportJob)
+        req.redirect(req.href.trello(job=idJob))
+
+    # /trello/jobs/<id> progress as JSON, or as server-sent events until
+    # the job ends; POST /trello/jobs/<id>/cancel stops it
+    def jobsController(self, req):
+        jobs = ImportJobs(self.env)
+        idJob = int(req.args.get('job'))
+        if req.args.get('action') == 'cancel':
+            if req.method != 'POST':
+                raise TracError('Cancel a job with a POST request')
+            job = jobs.cancel(idJob)
+            if job is not None and req.args.get('__FORM_TOKEN'):
+                # the cancel button of the import page
+                add_notice(req, 'Import job %s cancelled.' % idJob)
+                req.redirect(req.href.trello())
+        else:
+            job = jobs.getJob(idJob)
+        if job is None:
+            raise TracError('Import job %s not found' % idJob)
+
+        if 'text/event-stream' not in (req.get_header('Accept') or '') and req.args.get('stream') != '1':
+            response = json.dumps(job)
+            req.send_response(200)
+            req.send_header('Content-Type', 'application/json')
+            req.send_header('Content-Length', len(response))
+            req.end_headers()
+            req.write(response)
+            return
+
+        req.send_response(200)
+        req.send_header('Content-Type', 'text/event-stream')
+        req.send_header('Cache-Control', 'no-cache')
+        req.end_headers()
+        # browsers reconnect by themselves when the stream ends
+        deadline = time.time() + self.config.getint('trello', 'job_stream_timeout', 300)
+        last = None
+        while True:
+            event = json.dumps(job)
+            if event != last:
+                req.write('event: progress\ndata: %s\n\n' % event)
+                last = event
+            else:
+                req.write(': keepalive\n\n')
+            if job['status'] in FINISHED:
+                req.write('event: end\ndata: %s\n\n' % event)
+                break
+            if time.time() > deadline:
+                break
+            time.sleep(1)
+            job = jobs.getJob(idJob)
+
     def activeMilestonesController(self, req):
         # response = '''{"milestones": ["prima","seconda"]}'''
         response = json.dumps(self.getActiveMilestone())
@@ -737,9 +690,194 @@ class TrelloToTracPlugin(Component):
         req.end_headers()
         req.write(response)
 
+    # job worker: import the list of an ImportJobs job
+    def runImportJob(self, job, report):
+        profiler = TrelloProfiler(self.env)
+        if profiler.shouldProfileJob(job):
+            return profiler.runJob(job, self.importJob, report)
+        return self.importJob(job, report)
+
+    def importJob(self, job, report):
+        import trelloclient
+        trello = self.getTrelloClient(background=True)
+        if job['stage']:
+            # confirmed preview, no need to fetch the list again
+            stage = ImportStaging(self.env).get(job['stage'])
+            if stage is None:
+                raise TracError('The preview of job %s has expired' % job['id'])
+            bundles = stage['bundles']
+            total = len(bundles)
+        else:
+            context = self.getBoardContext(job['board'], trello, False)
+            cards = trelloclient.TrelloList(trello, job['list']).getCardList(context)
+            bundles = trelloclient.iterBundles(trello, cards, context)
+            total = len(cards)
+        counts = {'total' : total, 'done' : 0, 'skipped' : 0, 'failed' : 0}
+        report(counts, True)
+        results = self.importCardBundles(bundles, job['milestone'], job['iteration'], trello)
+        try:
+            for result in results:
+                if result['res']:
+                    counts['done'] += 1
+                elif result.get('skipped'):
+                    counts['skipped'] += 1
+                else:
+                    counts['failed'] += 1
+                    self.log.warning('Import job %s: %s', job['id'], result['msg'])
+                if not report(counts):
+                    # stops after the committed batch
+                    results.close()
+                    return 'cancelled'
+        finally:
+            report(counts, True)
+        if job['stage']:
+            ImportStaging(self.env).discard(job['stage'])
+        return 'done'
+
+    # card -> ticket
+    def importCardBundle(self, bundle, milestone, iteration, trello):
+        results = self.importCardBundles([bundle], milestone, iteration, trello)
+        return list(results)[0]
+
+    # render and link cards on the worker pool, write tickets in order,
+    # checkpoint(cursor, cardId, count) runs inside every batch transaction,
+    # it stays before the first card that failed so a resume retries it
+    # without trello no link to the ticket is attached to the cards
+    def importCardBundles(self, bundles, milestone, iteration, trello, checkpoint=None):
+        import trelloclient
+        from pipeline import ImportPipeline
+        from writer import TicketWriter
+        workers = self.config.getint('trello', 'import_workers', 4)
+        batchSize = self.config.getint('trello', 'import_batch_size', 50)
+        writer = TicketWriter(self.env.get_db_cnx())
+        progress = {'card' : None, 'count' : 0, 'failed' : False}
+
+        def write(cardContent):
+            profiling.countCards()
+            if (self.ticketCardExist(cardContent['id'])):
+                advance(cardContent['id'])
+                return {'res':False, 'skipped':True, 'msg':'Card "%s" already exists' % cardContent['name']}
+            record = self.getTicketRecord(cardContent, milestone, iteration)
+            idTicket = writer.write(record)
+            advance(cardContent['id'])
+            return {'res':True, 'id':idTicket, 'name':cardContent['name'], 'card':cardContent['id']}
+
+        def advance(cardId):
+            if not progress['failed']:
+                progress['card'] = cardId
+                progress['count'] += 1
+
+        # a card that can't be rendered or written is reported, the others go on
+        def fail(bundle, error):
+            progress['failed'] = True
+            self.log.warning('Card %s not imported: %s', bundle.id, error)
+            return {'res':False, 'msg':'Card "%s" not imported: %s' % (bundle.name, error)}
+
+        def attach(result):
+            if result['res'] and trello is not None:
+                # Attach link to card on trello
+                card = trelloclient.TrelloCard(trello, result['card'])
+                card.addLinkAttachment(self.getLinkByTicketId(result['id']))
+
+        def commit():
+            if checkpoint is not None and progress['card'] is not None:
+                checkpoint(writer.cursor, progress['card'], progress['count'])
+            writer.commit()
+
+        pipeline = ImportPipeline(workers, self.log)
+        return pipeline.run(bundles, self.renderCardBundle, write, attach, commit, writer.rollback, batchSize, fail)
+
+    def renderCardBundle(self, bundle):
+        estimationTools = self.config.getbool('trello', 'estimationtools')
+
+        cardContent = {}
+        cardContent['id'] = bundle.id
+        cardContent['name'] = bundle.name
+        cardContent['url'] = bundle.url
+        cardContent['size'] = None
+        cardContent['comments'] = bundle.comments
+        cardContent['hash'] = self.getCardHash(bundle)
+
+        #size and name/title
+        if estimationTools:
+            resultSize = self.getSizeByName(bundle.name)
+            cardContent['size'] = resultSize['size']
+            cardContent['name'] = resultSize['name']
+
+        #date
+        cardContent['timestamp'] = getObjectIdTime(bundle.id)
+
+        #add link to card
+        cardContent['desc'] = '\'\'\'Card Link:\'\'\'[[br]]\n[' + cardContent['url'] + ' vai a Trello] [[br]] \n'
+        #covert desc markdown to trac wiki
+        cardContent['desc'] += '[[br]]\'\'\'Description:\'\'\'[[br]]\n'+self.convertMarkdown(bundle.desc) + ' [[br]] \n'
+
+        cardContent['board'] = bundle.idBoard
+        reporter = self.getUserByTrelloId(bundle.createAction['idMemberCreator'], bundle.idBoard)
+        if reporter is None:
+            reporter = 'trello'
+        cardContent['reporter'] = reporter
+
+        # owner, getFirstMember pops it out of the cc members
+        members = list(bundle.members)
+        cardContent['owner'] = self.getFirstMember(members, bundle.idBoard)
+
+        #cc alla assigned member
+        cardContent['cc'] = self.addMembersToCc(members, bundle.idBoard)
+
+        #checklist
+        cardContent['desc'] = self.addChecklistsToDesc(bundle.checklists, cardContent['desc'])
+
+        #import attachments
+        cardContent['desc'] = self.addAttachmentsToDesc(bundle.attachments, cardContent['desc'])
+
+        #labels
+        cardContent['desc'] = self.addLabelsToDesc(bundle.labels, cardContent['desc'])
+        return cardContent
+
+    def getTicketRecord(self, cardContent, milestone, iteration):
+        agileTrac = self.config.getbool('trello', 'agile_trac')
+        estimationTools = self.config.getbool('trello', 'estimationtools')
+
+        #general ticket data
+        ticket = {
+            'type' : 'task',
+            'time' : cardContent['timestamp'],
+            'changetime' : cardContent['timestamp'],
+            'component' : '',
+            'severity' : 'normale',
+            'priority' : 'normale',
+            'owner' : cardContent['owner'],
+            'reporter' : cardContent['reporter'],
+            'cc' : cardContent['cc'],
+            'version' : '',
+            'milestone' : milestone,
+            'status' : 'new',
+            'resolution' : '',
+            'summary' : cardContent['name'],
+            'description' : cardContent['desc'],
+            'keywords' : '',
+        }
+        record = {'ticket' : ticket, 'card' : cardContent['id'], 'hash' : cardContent['hash'], 'iteration' : None}
+
+        # add trellocard id on ticket custom fields
+        record['custom'] = [('trellocard', cardContent['id'])]
+        #add size
+        if estimationTools and cardContent['size'] is not None:
+            estimationToolsField = self.config.get('estimation-tools', 'estimation_field')
+            record['custom'].append((estimationToolsField, cardContent['size']))
+
+        #comment
+        record['changes'] = self.getCommentChanges(cardContent['comments'], cardContent['board'])
+
+        #add ticket to iteration
+        if agileTrac:
+            record['iteration'] = iteration
+        return record
+
     def validateMilestone(self, milestone):
         db = self.env.get_db_cnx()
-        cursor = db.cursor()
+        cursor = metrics.cursor(db)
         sql = "SELECT * FROM milestone WHERE name LIKE %s"
         cursor.execute(sql, [milestone])
         row = cursor.fetchone()
@@ -754,7 +892,7 @@ class TrelloToTracPlugin(Component):
         if not u.isnumeric():
             return {'res':False, 'msg':'Iteration must be a number.'}
         db = self.env.get_db_cnx()
-        cursor = db.cursor()
+        cursor = metrics.cursor(db)
         sql = "SELECT * FROM iteration WHERE id=%s"
         cursor.execute(sql, [iteration])
         row = cursor.fetchone()
@@ -794,68 +932,92 @@ class TrelloToTracPlugin(Component):
         else:
             return {'res':False, 'msg':'List is not exist.'}
 
-    def addTicketToIteration(self, idTicket, idIteration):
-        db = self.env.get_db_cnx()
-        cursor = db.cursor()
-        cursor.execute("INSERT INTO iteration_ticket VALUES ((%s),(%s))",[ idIteration, idTicket ])
-
-    def addMembersToCc(self, members):
-        cc=''
-        count = 1
-        l = len(members)
+    # members without a Trac user are left out
+    def addMembersToCc(self, members, boardId=None):
+        cc = []
         for m in members:
-            tracUser = self.getUserByTrelloId(m['id'])
-            cc += tracUser
-            if count < l :
-                cc += ','
-            count += 1
-        return cc
-
-    def addChecklistsToDesc(self, checklists, desc, trello):
+            tracUser = self.getUserByTrelloId(m['id'], boardId)
+            if tracUser is not None and tracUser not in cc:
+                cc.append(tracUser)
+        return ','.join(cc)
+
+    def addChecklistsToDesc(self, checklists, desc):
         if len(checklists):
-            desc += '[[br]] \n\'\'\'Checklists:\'\'\' [[br]]\n'
-            for c in checklists:
-                checklist = trelloclient.TrelloChecklist(trello, c)
-                checklist = checklist.getChecklistInformation()
-                desc += '\'\'' + checklist['name'] + '\'\' [[br]]\n'
+            parts = [desc, '[[br]] \n\'\'\'Checklists:\'\'\' [[br]]\n']
+            for checklist in checklists:
+                parts.append('\'\'' + checklist['name'] + '\'\' [[br]]\n')
                 for item in checklist['checkItems']:
-                    desc += ' * ' + item['name'] + '\n'
+                    parts.append(' * ' + item['name'] + '\n')
+            desc = ''.join(parts)
         return desc
 
     def addAttachmentsToDesc(self, attachments, desc):
         if len(attachments):
-            desc += '[[br]] \n\'\'\'Attachments:\'\'\' [[br]]\n\'\''
+            parts = [desc, '[[br]] \n\'\'\'Attachments:\'\'\' [[br]]\n\'\'']
             for a in attachments:
-                desc += '[' + a['url'] + ' '  + a['name'] + ']\'\' [[br]]\n'
+                parts.append('[' + a['url'] + ' '  + a['name'] + ']\'\' [[br]]\n')
+            desc = ''.join(parts)
         return desc
 
     def addLabelsToDesc(self, labels, desc):
         if len(labels):
-            desc += '[[br]] \n\'\'\'Label:\'\'\' [[br]]\n'
+            parts = [desc, '[[br]] \n\'\'\'Label:\'\'\' [[br]]\n']
             for l in labels:
                 if l['name'] == '':
-                    desc += '\'\'' + l['color'] + '\'\' [[br]]\n'
+                    parts.append('\'\'' + l['color'] + '\'\' [[br]]\n')
                 else:
-                    desc += '\'\'' + l['color'] + ': ' + l['name'] + '\'\' [[br]]\n'
+                    parts.append('\'\'' + l['color'] + ': ' + l['name'] + '\'\' [[br]]\n')
+            desc = ''.join(parts)
         return desc
 
-    def addCommentsToTicket(self, comments, idTicket):
+    # converted descriptions and comments, keyed by content hash
+    def convertMarkdown(self, text):
+        if isinstance(text, unicode):
+            key = hashlib.sha1(text.encode('utf-8')).hexdigest()
+        else:
+            key = hashlib.sha1(text).hexdigest()
+        return self.getConvertCache().get(key, lambda: self.timedConvert(text))
+
+    def timedConvert(self, text):
+        import markdowntowiki
+        start = time.time()
+        wiki = markdowntowiki.convert(text)
+        metrics.REGISTRY.observe(metrics.REGISTRY.convertSeconds, (), time.time() - start)
+        metrics.REGISTRY.inc(metrics.REGISTRY.convertBytes, (), len(text))
+        return wiki
+
+    def getConvertCache(self):
+        size = self.config.getint('trello', 'convert_cache_size', 2048)
+        cache = getattr(self, '_convertCache', None)
+        if cache is None or cache.maxSize != size:
+            cache = self._convertCache = LruCache(size)
+        return cache
+
+    # hash of everything the ticket description is rendered from
+    def getCardHash(self, bundle):
+        source = [bundle.url, bundle.desc,
+                  [(c['name'], [i['name'] for i in c['checkItems']]) for c in bundle.checklists],
+                  [(a['url'], a['name']) for a in bundle.attachments],
+                  [(l['color'], l['name']) for l in bundle.labels]]
+        return hashlib.sha1(json.dumps(source, sort_keys=True)).hexdigest()
+
+    def getCardHashByCardId(self, cardId):
         db = self.env.get_db_cnx()
-        cursor = db.cursor()
+        cursor = metrics.cursor(db)
+        cursor.execute("SELECT deschash FROM trello_card_map WHERE card = %s", [cardId])
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        return row[0]
+
+    def getCommentChanges(self, comments, boardId=None):
+        changes = []
         for c in comments:
-            dtComment = parser.parse(c['date'])
-            timestamp = int(time.mktime(dtComment.timetuple())-time.timezone)
-            userComment = self.getUserByTrelloId(c['idMemberCreator'])
-            m2w = markdowntowiki.MarkdownToWiki(c['data']['text']).convert()
-            cursor.execute("INSERT INTO ticket_change VALUES ((%s),(%s),(%s),(%s),(%s),(%s))",[idTicket,timestamp,userComment,'comment', '', m2w])
-
-    def addSizeToTicket(self, size, estimationToolsField, idTicket, timestamp, creator):
-        if size is not None:
-            db = self.env.get_db_cnx()
-            cursor = db.cursor()
-            cursor.execute("INSERT INTO ticket_custom VALUES ((%s),(%s),(%s))",[idTicket,estimationToolsField,size])
-            #if you want to have history
-            #cursor.execute("INSERT INTO ticket_change VALUES ((%s),(%s),(%s),(%s),(%s),(%s))",[idTicket,timestamp,creator,estimationToolsField, '',size])
+            timestamp = parseTrelloDate(c['date'])
+            userComment = self.getUserByTrelloId(c['idMemberCreator'], boardId) or 'trello'
+            m2w = self.convertMarkdown(c['data']['text'])
+            changes.append((timestamp, userComment, 'comment', '', m2w))
+        return changes
 
     def getSizeByName(self, name):
         if re.search(r"^\((\d+)\) ", name):
@@ -867,45 +1029,51 @@ class TrelloToTracPlugin(Component):
 
 
     def getBoardList(self, boardList, trello):
+        import trelloclient
+        cache = self.getMetadataCache()
         boards = []
         for bId in boardList:
-            b = trelloclient.TrelloBoard(trello, bId).getBoardInformation()
-            board = {}
-            board['id'] = b['id']
-            board['name'] = b['name']
-            boards.append(board)
+            def load(bId=bId):
+                b = trelloclient.TrelloBoard(trello, bId).getBoardInformation()
+                return {'id':b['id'], 'name':b['name']}
+            boards.append(dict(cache.get(('board', bId), load)))
         return boards
 
     def getListList(self, listList, trello):
+        import trelloclient
+        cache = self.getMetadataCache()
         lists = []
         for lId in listList:
-            l = trelloclient.TrelloList(trello, lId).getListInformation()
-            lis = {}
-            lis['id'] = l['id']
-            lis['name'] = l['name']
-            lists.append(lis)
+            def load(lId=lId):
+                l = trelloclient.TrelloList(trello, lId).getListInformation()
+                return {'id':l['id'], 'name':l['name']}
+            lists.append(dict(cache.get(('list', lId), load)))
         return lists
 
+    # board and list names shown by the forms
+    def getMetadataCache(self):
+        ttl = self.config.getint('trello', 'metadata_cache_ttl', 300)
+        size = self.config.getint('trello', 'metadata_cache_size', 256)
+        cache = getattr(self, '_metadataCache', None)
+        if cache is None or cache.ttl != ttl or cache.maxSize != size:
+            cache = self._metadataCache = TtlCache(size, ttl)
+        return cache
+
     def getActiveMilestone(self):
         db = self.env.get_db_cnx()
-        cursor = db.cursor()
+        cursor = metrics.cursor(db)
         sql = "SELECT name FROM milestone WHERE completed = 0 ORDER BY name ASC"
         cursor.execute(sql)
         milestones = cursor.fetchall()
         return milestones
 
-    def getFirstMember(self, members):
+    def getFirstMember(self, members, boardId=None):
         if len(members) > 0:
             owner = members.pop(0)
-            return self.getUserByTrelloId(owner['id'])
+            return self.getUserByTrelloId(owner['id'], boardId)
         else:
             return None
 
-    def addTrellocardToTicket(self, idTicket, cardId):
-        db = self.env.get_db_cnx()
-        cursor = db.cursor()
-        cursor.execute("INSERT INTO ticket_custom (ticket, name, value) VALUES ((%s), 'trellocard', (%s));", [idTicket, cardId ])
-
     def getLinkByTicketId(self, idTicket):
         host = self.config.get('project', 'url')
         link = host + 'ticket/' + str(idTicket)
@@ -913,8 +1081,8 @@ class TrelloToTracPlugin(Component):
 
     def getTicketIdByCardId(self, cardId):
         db = self.env.get_db_cnx()
-        cursor = db.cursor()
-        sql = "SELECT ticket FROM ticket_custom WHERE name = 'trellocard' AND value LIKE %s"
+        cursor = metrics.cursor(db)
+        sql = "SELECT ticket FROM trello_card_map WHERE card = %s"
         cursor.execute(sql, [cardId])
         row = cursor.fetchone()
         if row is None:
@@ -924,8 +1092,8 @@ class TrelloToTracPlugin(Component):
 
     def getCardIdByTicketId(self, ticketId):
         db = self.env.get_db_cnx()
-        cursor = db.cursor()
-        sql = "SELECT value FROM ticket_custom WHERE name = 'trellocard' AND ticket = %s"
+        cursor = metrics.cursor(db)
+        sql = "SELECT card FROM trello_card_map WHERE ticket = %s"
         cursor.execute(sql, [ticketId])
         row = cursor.fetchone()
         if row is None or row[0] == '':
@@ -935,16 +1103,20 @@ class TrelloToTracPlugin(Component):
 
     def addCommentToTicket(self, comment, idTicket):
         db = self.env.get_db_cnx()
-        cursor = db.cursor()
-        dtComment = parser.parse(comment['date'])
-        timestamp = int(time.mktime(dtComment.timetuple())-time.timezone)
-        userComment = self.getUserByTrelloId(comment['idMemberCreator'])
-        m2w = markdowntowiki.MarkdownToWiki(comment['data']['text']).convert()
+        cursor = metrics.cursor(db)
+        timestamp = parseTrelloDate(comment['date'])
+        userComment = self.getUserByTrelloId(comment['idMemberCreator'], comment['data'].get('board', {}).get('id')) or 'trello'
+        m2w = self.convertMarkdown(comment['data']['text'])
+        # the same action can come from a webhook retry and from the delta sync
+        cursor.execute("SELECT 1 FROM ticket_change WHERE ticket = %s AND time = %s AND field = 'comment' AND newvalue = %s", [idTicket, timestamp, m2w])
+        if cursor.fetchone() is not None:
+            return False
         cursor.execute("INSERT INTO ticket_change VALUES ((%s),(%s),(%s),(%s),(%s),(%s))",[idTicket,timestamp,userComment,'comment', '', m2w])
+        return True
 
     def addCommentByAction(self, action):
         db = self.env.get_db_cnx()
-        cursor = db.cursor()
+        cursor = metrics.cursor(db)
         idTicket = self.getTicketIdByCardId(action.data['card']['id'])
         if idTicket != None and not self.isCommentFromTrac(action.data['text']):
             comment = {}
@@ -968,8 +1140,8 @@ class TrelloToTracPlugin(Component):
 
     def ticketCardExist(self, cardId):
         db = self.env.get_db_cnx()
-        cursor = db.cursor()
-        sql = "SELECT ticket FROM ticket_custom WHERE name = 'trellocard' AND value LIKE %s"
+        cursor = metrics.cursor(db)
+        sql = "SELECT ticket FROM trello_card_map WHERE card = %s"
         cursor.execute(sql, [cardId])
         row = cursor.fetchone()
         if row is None:
@@ -2,6 +2,9 @@
 @author: matteo@magni.me
 '''
 import json
+import threading
+import time
+import urllib
 from trolly.client import Client
 from trolly.organisation import Organisation
 from trolly.board import Board
@@ -10,67 +13,147 @@ from trolly.card import Card
 from trolly.checklist import Checklist
 from trolly.member import Member
 from trolly.trelloobject import TrelloObject
-from trolly import ResourceUnavailable
+from trolly import ResourceUnavailable, Unauthorised
 
-import urllib2
+from transport import HttpTransport, TransportError
+from ratelimit import RequestScheduler, INTERACTIVE
+import metrics
+
+API_URL = 'https://api.trello.com/1'
+# items per page of the paginated iterators, Trello allows up to 1000
+PAGE_SIZE = 100
+
+# nested resources fetched with every card of a bundle
+CARD_BUNDLE_PARAMS = {
+    'fields' : 'name,desc,url,labels,idBoard,idList,idShort',
+    'members' : 'true',
+    'member_fields' : 'username,fullName',
+    'checklists' : 'all',
+    'checklist_fields' : 'name,idCard,pos',
+    'attachments' : 'true',
+    'attachment_fields' : 'name,url',
+    'actions' : 'createCard,commentCard',
+    'actions_limit' : 1000,
+}
+
+# card fields when labels and members come from a TrelloBoardContext
+CONTEXT_CARD_FIELDS = 'name,desc,url,idLabels,idMembers,idBoard,idList,idShort'
+
+# checklists fetched on their own, with their check items
+CHECKLIST_PARAMS = {
+    'fields' : 'name,idCard,pos',
+    'checkItems' : 'all',
+    'checkItem_fields' : 'name,state,pos',
+}
 
 class TrelloClient(Client):
-    def __init__(self, apiKey, userAuthToken):
+    def __init__(self, apiKey, userAuthToken, transport=None, scheduler=None, priority=INTERACTIVE, apiUrl=API_URL, pageSize=PAGE_SIZE):
         Client.__init__(self, apiKey, userAuthToken )
         #super(TrelloClient, self).__init__( apiKey, userAuthToken )
+        self.apiUrl = apiUrl.rstrip('/')
+        self.pageSize = pageSize
+        if transport is None:
+            transport = HttpTransport()
+        if scheduler is None:
+            scheduler = RequestScheduler()
+        self.transport = transport
+        self.scheduler = scheduler
+        self.priority = priority
+
+    def buildUri(self, path, query_params):
+        return self.apiUrl + path + '?' + urllib.urlencode(query_params)
+
+    # every trolly call ends up here, send it over the pooled transport
+    def fetchJson(self, uri_path, http_method='GET', query_params={}, body=None, headers={}):
+        query_params = self.addAuthorisation(dict(query_params))
+        uri = self.buildUri(uri_path, query_params)
+        headers = dict(headers)
+        if http_method in ('POST', 'PUT', 'DELETE') and 'Content-Type' not in headers:
+            headers['Content-Type'] = 'application/json'
+        headers['Accept'] = 'application/json'
+        def send():
+            return self.transport.request(http_method, uri, body, headers)
+        labels = (http_method, metrics.endpoint(uri_path))
+        start = time.time()
+        try:
+            response = self.scheduler.execute(send, self.priority)
+        except Exception, e:
+            metrics.REGISTRY.inc(metrics.REGISTRY.apiErrors, labels + (e.__class__.__name__,))
+            raise
+        finally:
+            metrics.REGISTRY.observe(metrics.REGISTRY.apiSeconds, labels, time.time() - start)
+        if response.status != 200:
+            metrics.REGISTRY.inc(metrics.REGISTRY.apiErrors, labels + (str(response.status),))
+        if response.status == 401:
+            raise Unauthorised(uri, response)
+        if response.status != 200:
+            raise ResourceUnavailable(uri, response)
+        return json.loads(response.content)
+
+    # items of a collection ordered by id newest first (actions), one page
+    # of pageSize at a time; every page asks for the items before the
+    # oldest id of the last one. Stops on a page without new items, in case
+    # the endpoint ignores limit or before
+    def iterPages(self, uri_path, query_params={}, since=None, before=None, pageSize=None):
+        pageSize = pageSize or self.pageSize
+        seen = set()
+        while True:
+            params = dict(query_params)
+            params['limit'] = pageSize
+            if since:
+                params['since'] = since
+            if before:
+                params['before'] = before
+            page = self.fetchJson(uri_path = uri_path, query_params = params)
+            fresh = [item for item in page if item['id'] not in seen]
+            for item in fresh:
+                seen.add(item['id'])
+                yield item
+            if len(page) < pageSize or not fresh:
+                return
+            oldest = min(item['id'] for item in page)
+            if oldest == before:
+                return
+            before = oldest
 
     def cardExist(self, cardId):
         try:
-            query_params = {}
-            query_params = self.addAuthorisation(query_params)
-            uri_path = '/cards/' + cardId
-            uri = self.buildUri( uri_path, query_params )
-            fileHandle = urllib2.urlopen(uri)
-            data = fileHandle.read()
-            fileHandle.close()
+            self.fetchJson(
+                uri_path = '/cards/' + cardId,
+                query_params = {'fields' : 'id'}
+            )
             return {'res':True}
-        except urllib2.URLError, e:
+        except (ResourceUnavailable, Unauthorised, TransportError), e:
             return {'res':False}
 
     def cardShortIdExist(self, cardShortId, boardId):
         try:
-            query_params = {}
-            query_params = self.addAuthorisation(query_params)
-            uri_path = '/boards/' + boardId + '/cards/' + cardShortId
-            uri = self.buildUri( uri_path, query_params )
-            fileHandle = urllib2.urlopen(uri)
-            data = fileHandle.read()
-            fileHandle.close()
-            data = json.loads( data )
+            data = self.fetchJson(
+                uri_path = '/boards/' + boardId + '/cards/' + cardShortId,
+                query_params = {'fields' : 'id'}
+            )
             return {'res':True,'id':data['id']}
-        except urllib2.URLError, e:
+        except (ResourceUnavailable, Unauthorised, TransportError), e:
             return {'res':False}
 
     def boardExist(self, boardId):
         try:
-            query_params = {}
-            query_params = self.addAuthorisation(query_params)
-            uri_path = '/boards/' + boardId
-            uri = self.buildUri( uri_path, query_params )
-            fileHandle = urllib2.urlopen(uri)
-            data = fileHandle.read()
-            fileHandle.close()
+            self.fetchJson(
+                uri_path = '/boards/' + boardId,
+                query_params = {'fields' : 'id'}
+            )
             return {'res':True}
-        except urllib2.URLError, e:
+        except (ResourceUnavailable, Unauthorised, TransportError), e:
             return {'res':False}
 
     def listExist(self, listId):
         try:
-            query_params = {}
-            query_params = self.addAuthorisation(query_params)
-            uri_path = '/lists/' + listId
-            uri = self.buildUri( uri_path, query_params )
-            fileHandle = urllib2.urlopen(uri)
-            data = fileHandle.read()
-            fileHandle.close()
-            data = json.loads( data )
+            data = self.fetchJson(
+                uri_path = '/lists/' + listId,
+                query_params = {'fields' : 'idBoard'}
+            )
             return {'res':True, 'boardId':data['idBoard']}
-        except urllib2.URLError, e:
+        except (ResourceUnavailable, Unauthorised, TransportError), e:
             return {'res':False}
 
 
@@ -78,12 +161,42 @@ class TrelloBoard(Board):
     def __init__(self, trelloClient, boardId):
         Board.__init__(self, trelloClient, boardId )
         #super(TrelloBoard, self).__init__( trelloClient, boardId )
+
+    # newest first
+    def iterActions(self, filter, since=None, before=None):
+        return self.client.iterPages(self.base_uri+'/actions', {'filter' : filter, 'memberCreator' : 'true'}, since, before)
+
+    # actions newer than the since action id, oldest first
+    def getActionsSince(self, since, filter):
+        actions = list(self.iterActions(filter, since))
+        actions.reverse()
+        return actions
+
     def getCardByShortId(self, shortId):
         return self.fetchJson(
             uri_path = self.base_uri+'/cards/'+shortId,
             query_params = {}
         )
 
+    # checklists of every card of the board by card id, in one request
+    def getChecklistIndex(self):
+        return indexChecklists(self.fetchJson(
+            uri_path = self.base_uri+'/checklists',
+            query_params = dict(CHECKLIST_PARAMS)
+        ))
+
+    def getLabelList(self):
+        return self.fetchJson(
+            uri_path = self.base_uri+'/labels',
+            query_params = {'fields' : 'color,name', 'limit' : 1000}
+        )
+
+    def getMemberList(self):
+        return self.fetchJson(
+            uri_path = self.base_uri+'/members',
+            query_params = {'fields' : 'username,fullName,email'}
+        )
+
 
 class TrelloList(List):
     def __init__(self, trelloClient, listId):
@@ -96,16 +209,36 @@ class TrelloList(List):
             query_params = {'fields' : 'all'}
         )
 
+    # cards of the list in list order with members, checklists,
+    # attachments, labels and comments nested, in a single request (the
+    # cards of a list are not ordered by id, they can't be paged with
+    # before); with a TrelloBoardContext only the card's own resources
+    def getCardList(self, context=None):
+        return self.fetchJson(
+            uri_path = self.base_uri+'/cards',
+            query_params = getBundleParams(context)
+        )
+
+    def iterCardBundles(self, context=None):
+        return iterBundles(self.client, self.getCardList(context), context)
+
+    def getCardBundles(self, context=None):
+        return list(self.iterCardBundles(context))
+
 class TrelloCard(Card):
     def __init__(self, trelloCard, cardId):
         Card.__init__(self, trelloCard, cardId)
         #super(TrelloCard, self).__init__( trelloClient, cardId )
 
+    # newest first
+    def iterActions(self, filter, since=None, before=None):
+        return self.client.iterPages(self.base_uri+'/actions', {'filter' : filter}, since, before)
+
+    def iterComments(self, since=None, before=None):
+        return self.iterActions('commentCard', since, before)
+
     def getComments(self):
-        return self.fetchJson(
-            uri_path = self.base_uri+'/actions',
-            query_params = {'filter':'commentCard'}
-        )
+        return list(self.iterComments())
 
     def getChecklists(self):
         return self.fetchJson(
@@ -143,6 +276,19 @@ class TrelloCard(Card):
             response['actions'].insert(0,json.loads(json_action))
         return response
 
+    # the card with all its nested resources in a single request
+    def getCardBundle(self, context=None):
+        response = self.fetchJson(
+            uri_path = self.base_uri,
+            query_params = getBundleParams(context)
+        )
+        if context is not None:
+            if response.get('idBoard') != context.id:
+                # a card of another board, fetch it again with everything nested
+                return self.getCardBundle()
+            response = context.complete(response, self.client)
+        return completeBundle(self.client, TrelloCardBundle(response))
+
     def addLinkAttachment(self, link):
         return self.fetchJson(
             uri_path=self.base_uri + '/attachments',
@@ -151,6 +297,126 @@ class TrelloCard(Card):
         )
 
 
+class TrelloCardBundle(object):
+    def __init__(self, json):
+        self.json = json
+        self.id = json['id']
+        self.name = json['name']
+        self.url = json['url']
+        self.idBoard = json.get('idBoard')
+        self.desc = json.get('desc', '')
+        self.labels = json.get('labels', [])
+        self.members = json.get('members', [])
+        self.checklists = sortChecklists(json.get('checklists', []))
+        self.attachments = json.get('attachments', [])
+        actions = json.get('actions', [])
+        self.comments = [a for a in actions if a['type'] == 'commentCard']
+        createActions = [a for a in actions if a['type'] == 'createCard']
+        if len(createActions) != 0:
+            self.createAction = createActions[0]
+        else:
+            self.createAction = {'idMemberCreator' : '', 'date' : ''}
+
+
+class TrelloBoardContext(object):
+    # labels, members and optionally checklists of a board, fetched once
+    # for all the cards of an import; cards are then fetched with label and
+    # member ids only and completed from here. An id unknown to the context
+    # (added since) reloads labels or members, once per unknown id. The
+    # context can be shared, reloads go through the client of the caller.
+    def __init__(self, trelloClient, boardId, checklists=True, onMembers=None):
+        self.id = boardId
+        self.lock = threading.Lock()
+        self.onMembers = onMembers
+        # ids still unknown after a reload, they don't reload again
+        self.missing = set()
+        self.labels = self.loadLabels(trelloClient)
+        self.members = self.loadMembers(trelloClient)
+        self.checklists = None
+        if checklists:
+            self.checklists = TrelloBoard(trelloClient, boardId).getChecklistIndex()
+
+    def loadLabels(self, trelloClient):
+        return dict((l['id'], l) for l in TrelloBoard(trelloClient, self.id).getLabelList())
+
+    def loadMembers(self, trelloClient):
+        members = TrelloBoard(trelloClient, self.id).getMemberList()
+        if self.onMembers is not None:
+            self.onMembers(self.id, members)
+        return dict((m['id'], m) for m in members)
+
+    # the card json as if labels, members and checklists were nested
+    def complete(self, card, trelloClient):
+        card = dict(card)
+        card['labels'] = self.resolve('labels', card.get('idLabels', []), trelloClient)
+        card['members'] = self.resolve('members', card.get('idMembers', []), trelloClient)
+        if self.checklists is not None:
+            card['checklists'] = self.checklists.get(card['id'], [])
+        return card
+
+    def resolve(self, kind, ids, trelloClient):
+        self.lock.acquire()
+        try:
+            known = getattr(self, kind)
+            unknown = [id for id in ids if id not in known and id not in self.missing]
+            if unknown:
+                if kind == 'labels':
+                    known = self.labels = self.loadLabels(trelloClient)
+                else:
+                    known = self.members = self.loadMembers(trelloClient)
+                self.missing.update(id for id in unknown if id not in known)
+            return [known[id] for id in ids if id in known]
+        finally:
+            self.lock.release()
+
+
+def getBundleParams(context=None):
+    params = dict(CARD_BUNDLE_PARAMS)
+    if context is not None:
+        params['fields'] = CONTEXT_CARD_FIELDS
+        del params['members'], params['member_fields']
+        if context.checklists is not None:
+            del params['checklists'], params['checklist_fields']
+    return params
+
+
+# checklists and their check items in board order
+def sortChecklists(checklists):
+    checklists = sorted(checklists, key=lambda c: c.get('pos', 0))
+    for c in checklists:
+        c['checkItems'] = sorted(c.get('checkItems', []), key=lambda i: i.get('pos', 0))
+    return checklists
+
+
+# card id -> checklists of the card
+def indexChecklists(checklists):
+    index = {}
+    for c in checklists:
+        index.setdefault(c.get('idCard'), []).append(c)
+    for idCard in index:
+        index[idCard] = sortChecklists(index[idCard])
+    return index
+
+
+# bundles of the fetched cards, built as they are consumed
+def iterBundles(client, cards, context=None):
+    for c in cards:
+        if context is not None:
+            c = context.complete(c, client)
+        yield completeBundle(client, TrelloCardBundle(c))
+
+
+# nested actions stop at actions_limit, page the rest of the comments;
+# the json gets them too, so a staged bundle keeps every comment
+def completeBundle(client, bundle):
+    actions = bundle.json.get('actions', [])
+    if len(actions) >= CARD_BUNDLE_PARAMS['actions_limit']:
+        bundle.comments = list(TrelloCard(client, bundle.id).iterComments())
+        bundle.json = dict(bundle.json)
+        bundle.json['actions'] = [a for a in actions if a['type'] != 'commentCard'] + bundle.comments
+    return bundle
+
+
 class TrelloChecklist(Checklist):
     def __init__(self, trelloClient, checklistId):
         Checklist.__init__(self, trelloClient, checklistId )
@@ -0,0 +1,45 @@
+import time
+
+from trac.core import *
+
+import metrics
+from workqueue import WorkQueue
+
+
+class WebhookQueue(WorkQueue):
+    # webhook bodies applied by the handler of ensureWorker
+    table = 'trello_webhook_queue'
+    workerName = 'trello-webhook-queue'
+    pollOption = 'webhook_poll_interval'
+    claimedStatus = 'processing'
+    createdColumn = 'received'
+    statuses = ('pending', 'processing', 'dead')
+
+    def enqueue(self, payload):
+        now = int(time.time())
+        db = self.env.get_db_cnx()
+        cursor = metrics.cursor(db)
+        cursor.execute("INSERT INTO trello_webhook_queue (received, payload, status, attempts, next_attempt) VALUES ((%s),(%s),'pending',0,(%s))", [now, payload, now])
+        db.commit()
+        self.wakeup.set()
+
+    # process one batch, return the number of entries handled
+    def drain(self):
+        batchSize = self.config.getint('trello', 'webhook_batch_size', 50)
+        maxAttempts = self.config.getint('trello', 'webhook_max_attempts', 5)
+        now = int(time.time())
+
+        db = self.env.get_db_cnx()
+        cursor = metrics.cursor(db)
+        claimed = self.claimRows(cursor, ['payload', 'attempts'], batchSize, now)
+        db.commit()
+
+        for id, payload, attempts in claimed:
+            try:
+                self.handler(payload)
+            except Exception, e:
+                self.retry(cursor, [id], attempts + 1, maxAttempts, e, 'Webhook %s' % id)
+            else:
+                cursor.execute("DELETE FROM trello_webhook_queue WHERE id = %s", [id])
+            db.commit()
+        return len(claimed)
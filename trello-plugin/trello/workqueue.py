@@ -0,0 +1,114 @@
+import threading
+import time
+
+from trac.core import *
+
+import metrics
+
+# a claimed row not updated for this long belongs to a dead worker
+STALE_SECONDS = 300
+RETRY_DELAY = 10
+
+
+class WorkQueue(Component):
+    # rows of a table processed by one daemon thread per trac process;
+    # rows are claimed in the database so several processes can share the
+    # table. Subclasses name the table and statuses and implement drain()
+    abstract = True
+
+    table = None
+    workerName = None
+    pollOption = None
+    pendingStatus = 'pending'
+    claimedStatus = None
+    # claim time of a row, the stale claims are released on it
+    claimColumn = 'next_attempt'
+    # rows wait for their next_attempt
+    retries = True
+    createdColumn = None
+    statuses = ()
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.worker = None
+        self.handler = None
+
+    # handler is the callback drain() hands the rows to, the latest one
+    # wins (the plugin component passes a bound method on every request)
+    def ensureWorker(self, handler):
+        self.lock.acquire()
+        try:
+            self.handler = handler
+            if self.worker is None or not self.worker.isAlive():
+                self.worker = threading.Thread(target=self.run, name=self.workerName)
+                self.worker.setDaemon(True)
+                self.worker.start()
+        finally:
+            self.lock.release()
+
+    def run(self):
+        interval = self.config.getint('trello', self.pollOption, 5)
+        while True:
+            try:
+                while self.drain() > 0:
+                    pass
+            except Exception, e:
+                self.log.error('%s: %s', self.workerName, e)
+            self.wakeup.wait(interval)
+            self.wakeup.clear()
+            self.settle()
+
+    # after a wakeup, before draining
+    def settle(self):
+        pass
+
+    # handle one batch, return the number of rows handled
+    def drain(self):
+        raise NotImplementedError
+
+    # up to limit pending rows (id first, then columns) claimed for this
+    # process, after releasing the stale claims; the caller commits
+    def claimRows(self, cursor, columns, limit, now):
+        cursor.execute("UPDATE " + self.table + " SET status = %s WHERE status = %s AND " + self.claimColumn + " < %s", [self.pendingStatus, self.claimedStatus, now - STALE_SECONDS])
+        sql = "SELECT " + ', '.join(['id'] + columns) + " FROM " + self.table + " WHERE status = %s"
+        args = [self.pendingStatus]
+        if self.retries:
+            sql += " AND next_attempt <= %s"
+            args.append(now)
+        cursor.execute(sql + " ORDER BY id LIMIT %s", args + [limit])
+        claimed = []
+        for row in cursor.fetchall():
+            cursor.execute("UPDATE " + self.table + " SET status = %s, " + self.claimColumn + " = %s WHERE id = %s AND status = %s", [self.claimedStatus, now, row[0], self.pendingStatus])
+            if cursor.rowcount == 1:
+                claimed.append(row)
+        return claimed
+
+    # after a failed attempt the rows wait with an exponential backoff, or
+    # are kept as 'dead' after maxAttempts
+    def retry(self, cursor, ids, attempts, maxAttempts, error, what):
+        if attempts >= maxAttempts:
+            status = 'dead'
+            nextAttempt = int(time.time())
+            self.log.error('%s dropped after %d attempts: %s', what, attempts, error)
+        else:
+            status = self.pendingStatus
+            nextAttempt = int(time.time()) + RETRY_DELAY * 2 ** (attempts - 1)
+            self.log.warning('%s failed, attempt %d: %s', what, attempts, error)
+        cursor.executemany("UPDATE " + self.table + " SET status = %s, attempts = %s, next_attempt = %s, error = %s WHERE id = %s", [(status, attempts, nextAttempt, unicode(error), id) for id in ids])
+
+    # rows per status and the age of the oldest row not dead
+    def getDepth(self):
+        db = self.env.get_db_cnx()
+        cursor = metrics.cursor(db)
+        cursor.execute("SELECT status, COUNT(*), MIN(" + self.createdColumn + ") FROM " + self.table + " GROUP BY status")
+        depth = dict((status, 0) for status in self.statuses)
+        depth['lag'] = 0
+        oldest = None
+        for status, count, created in cursor.fetchall():
+            depth[status] = count
+            if status != 'dead' and created is not None and (oldest is None or created < oldest):
+                oldest = created
+        if oldest is not None:
+            depth['lag'] = max(0, int(time.time()) - oldest)
+        return depth
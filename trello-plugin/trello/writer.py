@@ -0,0 +1,84 @@
+import sys
+
+import metrics
+from pipeline import BatchAborted
+
+TICKET_COLUMNS = ['type', 'time', 'changetime', 'component', 'severity', 'priority', 'owner', 'reporter', 'cc', 'version', 'milestone', 'status', 'resolution', 'summary', 'description', 'keywords']
+
+
+class TicketWriter(object):
+    # writes assembled ticket records on a single connection, the caller
+    # decides how many records go in one transaction
+    #
+    # record = {
+    #     'ticket' : {column : value},
+    #     'card' : trello card id,
+    #     'hash' : hash of the card content the description comes from,
+    #     'custom' : [(name, value)],
+    #     'changes' : [(time, author, field, oldvalue, newvalue)],
+    #     'iteration' : iteration id or None,
+    # }
+    def __init__(self, db):
+        self.db = db
+        self.cursor = metrics.cursor(db)
+        self.pending = 0
+
+    # a record that fails is removed from the open transaction before the
+    # error is raised; if that fails too (the database aborted the whole
+    # transaction, e.g. PostgreSQL) BatchAborted is raised and the caller
+    # has to roll back
+    def write(self, record):
+        idTicket = None
+        try:
+            idTicket = self.writeTicket(record)
+            self.writeRelated(idTicket, record)
+        except Exception:
+            error = sys.exc_info()
+            try:
+                self.discard(idTicket, record)
+            except Exception, e:
+                raise BatchAborted('%s, then %s' % (error[1], e))
+            raise error[0], error[1], error[2]
+        self.pending += 1
+        return idTicket
+
+    def writeTicket(self, record):
+        ticket = record['ticket']
+        self.cursor.execute("INSERT INTO ticket (" + ', '.join(TICKET_COLUMNS) + ") VALUES (" + ','.join(['(%s)'] * len(TICKET_COLUMNS)) + ")", [ticket[c] for c in TICKET_COLUMNS])
+        return self.db.get_last_id(self.cursor, 'ticket')
+
+    def writeRelated(self, idTicket, record):
+        cursor = self.cursor
+
+        custom = [(idTicket, name, value) for name, value in record.get('custom', [])]
+        if custom:
+            cursor.executemany("INSERT INTO ticket_custom (ticket, name, value) VALUES ((%s),(%s),(%s))", custom)
+        if record.get('card'):
+            cursor.execute("INSERT INTO trello_card_map (card, ticket, deschash) VALUES ((%s),(%s),(%s))", [record['card'], idTicket, record.get('hash')])
+        changes = [(idTicket,) + tuple(change) for change in record.get('changes', [])]
+        if changes:
+            cursor.executemany("INSERT INTO ticket_change (ticket, time, author, field, oldvalue, newvalue) VALUES ((%s),(%s),(%s),(%s),(%s),(%s))", changes)
+        if record.get('iteration') is not None:
+            cursor.execute("INSERT INTO iteration_ticket VALUES ((%s),(%s))", [record['iteration'], idTicket])
+
+    # without a ticket row only checks that the transaction is still usable
+    def discard(self, idTicket, record):
+        cursor = self.cursor
+        if idTicket is None:
+            cursor.execute("SELECT 1")
+            return
+        cursor.execute("DELETE FROM ticket_custom WHERE ticket = %s", [idTicket])
+        cursor.execute("DELETE FROM ticket_change WHERE ticket = %s", [idTicket])
+        if record.get('card'):
+            cursor.execute("DELETE FROM trello_card_map WHERE ticket = %s", [idTicket])
+        if record.get('iteration') is not None:
+            cursor.execute("DELETE FROM iteration_ticket WHERE ticket = %s", [idTicket])
+        cursor.execute("DELETE FROM ticket WHERE id = %s", [idTicket])
+
+    def commit(self):
+        self.db.commit()
+        self.pending = 0
+
+    def rollback(self):
+        self.db.rollback()
+        self.pending = 0